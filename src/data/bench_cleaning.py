@@ -0,0 +1,393 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import re
+import sys
+import time
+from os import path
+
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), "../.."))
+import pandas as pd
+import unidecode
+from src.data import data_cleaning_util, legacy_cleaning
+
+# Words that trigger every spelling rule, mixed into the benchmark corpus so
+# the equivalence check covers each rule and rules firing together
+RULE_SAMPLES = [
+    "Chipolte", "chipottle", "Fritata", "frittatta", "Creme fresh", "creme Fraishe",
+    "Mascapone", "mascaprone", "Brussel sprout", "brussle Sprout", "Gnocci",
+    "Maccaroni", "macarroni", "Macaroon", "accaron", "Fettuccini", "fettucchine",
+    "Expresso", "Mozzarrella", "mozarela", "mozzarela ", "Sherbert", "cardamon",
+    "Linguini", "liquer", "Won ton", "Chile", "chilies", "Chiles", "&eacute;",
+    "&amp;egrave;", "&icirc;", "&amp;ucirc;", "&#231;", "&rsquo;", "&amp;ntilde;",
+    "redpepper", "blackpepper", "roastedalmonds", "XXshiitake", "1 1/2½", "1#3",
+    "1#12", "\xa0", "\x90", "×", "!*|`@+?", "�™‿•®§¤[]\u2028", "‘’",
+    "“”″‟", "&", "⁄", "‱",
+]
+
+# Abbreviations, number words, fractions and ranges in the shapes the
+# quantity normalizers rewrite, including several in one line
+QUANTITY_SAMPLES = [
+    "8 oz. cream cheese", "1 (14-oz) can", "2 oz", "4 oz.", "butter, 4 oz.",
+    "1 ozone, 2 oz.", "1lb. pasta", "2 lbs potatoes", "1 lb", "250 ml. milk",
+    "250 ml.", "milk, 250 ml.", "(500ml) stock", "1 ml", "200g flour", "200 g. sugar",
+    "20g", "1 Tbsp. oil", "2 tbsp butter", "1 tsp... salt", "3 Tsp",
+    "one and a half cups", " one and one-half cups", "one and one quarter",
+    "two and one-half", "three and a half", "One egg", "two or three eggs",
+    "dozen eggs", "someone else", "1½ cups", "1 ¾ cups", "¼ cup", "10⅞",
+    "1 2/3 cups", "1-1/2 cups", "2/3 cup", "1/3-1/2 cup", "3 to 4 pounds",
+    "1-2 cloves", "2.5 - 3 cups", "2 8.5-ounce cans", "3 12 ounce jars",
+    "1 tsp plus 2 tbsp", "2 1/4 oz. 1 lb 3-4 tsp", "1.5 or 2", "½ ⅓", "1/2 1/3",
+    "1 2 3 4", "1/4-1/2 teaspoon",
+]
+
+# Ingredient rows in the shape of the NYT html export
+NYT_SAMPLES = [
+    {
+        "input": "1 cup tomato sauce <a href=\"/recipes/1\">see recipe</a>",
+        "name": "tomato sauce",
+        "comment": "see recipe",
+    },
+    {
+        "input": "1 cup pesto (see <a href=\"/recipes/2\">recipe</a>)",
+        "name": "pesto",
+        "comment": "see recipe, optional",
+    },
+    {
+        "input": "<span>2</span> cups flour\\n",
+        "name": "<b>flour</b>",
+        "comment": float("nan"),
+    },
+    {"input": "salt\\tand pepper", "name": "salt", "comment": "\\n"},
+    {
+        "input": "<a href=\"x\">see recipe</a>",
+        "name": float("nan"),
+        "comment": "to taste",
+    },
+    {"input": "2 eggs", "name": "eggs", "comment": "<i>beaten</i> see recipe"},
+]
+
+# Measures in two units that fix_measurements merges into one
+MEASUREMENT_SAMPLES = [
+    "1 stick plus 2 tablespoons butter", "1 pound and 4 ounces beef",
+    "2 tablespoons plus 3 cloves garlic", "1 head and 2 cloves garlic",
+    "1 packet plus 1 teaspoon gelatin", "1 bottle plus 1 cup wine",
+    "1 cup plus 2 pinches salt", "1 ounce plus 2 tablespoons oil",
+    "1 quart plus 1 cup stock",
+]
+
+# Quantities and the gaps between them, every line of two and three of them
+# is added to the normalize_quantities check, the shapes the old chain
+# rewrote twice ("1/4-1/2" became "0.25.5") included
+QUANTITY_PARTS = ["2", "12", "3.5", "½", "1½", "1 ¾", "1/2", "1 1/2", "1-1/2"]
+QUANTITY_GAPS = ["", " ", "-", "\u2013", " - ", " to ", " or ", ".", " cup "]
+
+# Shapes of quantities the old chain rewrote again after a first merge,
+# which normalize_quantities merges once. SEPARATED_GAP finds text the old
+# patterns never merged across. Two numbers with any other gap than a
+# PLAIN_GAP count, and so do a fraction right before another number ("1½ ¾"
+# was 1.0.75), a decimal right before a fraction ("3.5-1/2" was 3.5.5), a
+# fraction right before a dot ("1 to 9/1." was 5) and REMERGED_QUANTITIES
+# numbers or more ("1 2 3 4" was 12 4).
+SEPARATED_GAP = re.compile(r"[^\s\-\u2010-\u2015\u2212tor./]")
+PLAIN_GAP = re.compile(r"\s*(?:-+\s*)?(?:(?:to|or)\s+)?")
+REMERGED_SHAPE = re.compile(
+    r"(?:[\u2150-\u215E\u00BC-\u00BE]|\d/\d+)[\s\-\u2010-\u2015\u2212]?"
+    r"[\d\u2150-\u215E\u00BC-\u00BE]"
+    r"|\d\.\d*[\s\-\u2010-\u2015\u2212]?(?:[\u2150-\u215E\u00BC-\u00BE]|\d+/\d)"
+    r"|\d/\d+\."
+)
+REMERGED_QUANTITIES = 4
+
+
+def remerged_quantities(line):
+    parts = data_cleaning_util.split_quantities(line)
+    quantities = [
+        i for i, part in enumerate(parts) if isinstance(part, data_cleaning_util.Quantity)
+    ]
+    if len(quantities) < 2:
+        return False
+    if len(quantities) >= REMERGED_QUANTITIES:
+        return True
+    for i in quantities[:-1]:
+        gap = parts[i + 1]
+        if not SEPARATED_GAP.search(gap) and not PLAIN_GAP.fullmatch(gap):
+            return True
+    return bool(REMERGED_SHAPE.search(line))
+
+
+# Lines the old loops rewrote twice. Each value they found was substituted
+# into the first match left in the line, which could take in the text of an
+# earlier substitution. The current functions rewrite every match once, so
+# these lines are counted as known differences, not as mismatches.
+KNOWN_DIFFERENCES = {
+    # "½ ⅓" became "0.0.33", now "0.5 0.33"
+    "clean_unicode_fractions": [
+        re.compile(
+            r"[\u2150-\u215E\u00BC-\u00BE]\s?[\u2150-\u215E\u00BC-\u00BE]"
+        ).search
+    ],
+    # "1 2 3 4" became "12 4", now "2 12", and "1-2-3-4" became "3.5-4", now
+    # "1.5-3.5"
+    "merge_quantities": [
+        re.compile(r"\d+\s+\d+\.*\d*\s+\d").search,
+        re.compile(
+            r"\d[\s\-]*[tor\-]+[\s\-]*\d+\.?\d*[\s\-]*[tor\-]+[\s\-]*\d"
+        ).search,
+    ],
+    # "1/4-1/2" became "0.25.5", now 0.38
+    "normalize_quantities": [remerged_quantities],
+}
+
+# Cleaning steps in the order the ingredient pipeline applies them
+PIPELINE = [
+    "clean_epi_html",
+    "fix_characters",
+    "fix_spelling",
+    "fix_abbreviations",
+    "fix_numeric_words",
+    "clean_unicode_fractions",
+    "unidecode",
+    "merge_fractions",
+    "merge_quantities",
+]
+
+
+def load_corpus(filename):
+    with open(filename, newline="") as f:
+        corpus = [row["input"] for row in csv.DictReader(f)]
+    # Every rule sample on its own, next to its neighbours and inside text
+    samples = RULE_SAMPLES + QUANTITY_SAMPLES
+    corpus.extend(samples)
+    corpus.extend(a + b for a in RULE_SAMPLES for b in RULE_SAMPLES)
+    corpus.extend(a + ", " + b for a in QUANTITY_SAMPLES for b in QUANTITY_SAMPLES)
+    corpus.extend("2 cups {} , finely chopped".format(s) for s in samples)
+    corpus.extend("epi:recipeLink id=\"\"1234\"\"<{}\\n\\t".format(s) for s in samples)
+    return corpus
+
+
+def time_function(func, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for s in corpus:
+            func(s)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, legacy_time, current_time, mismatches, known=()):
+    print(
+        "{:>23}: {:7.1f} ms -> {:7.1f} ms ({:.1f}x), {} mismatches{}".format(
+            name,
+            legacy_time * 1000,
+            current_time * 1000,
+            legacy_time / current_time,
+            len(mismatches),
+            ", {} known differences".format(len(known)) if known else "",
+        )
+    )
+    for s, a, b in mismatches[:10]:
+        print("    {!r}: {!r} != {!r}".format(s, a, b))
+    for s, a, b in known[:3]:
+        print("    known {!r}: {!r} -> {!r}".format(s, a, b))
+
+
+def known_difference(name, line):
+    return any(shape(line) for shape in KNOWN_DIFFERENCES.get(name, []))
+
+
+def compare(name, legacy, current, corpus, repeat):
+    differences = [
+        (s, legacy(s), current(s)) for s in corpus if legacy(s) != current(s)
+    ]
+    mismatches = [d for d in differences if not known_difference(name, d[0])]
+    known = [d for d in differences if known_difference(name, d[0])]
+    legacy_time = time_function(legacy, corpus, repeat)
+    current_time = time_function(current, corpus, repeat)
+    report(name, legacy_time, current_time, mismatches, known)
+    return not mismatches
+
+
+def clean_nyt_rows(clean_nyt_html, rows):
+    return [clean_nyt_html(dict(row)) for row in rows]
+
+
+def same_rows(a, b):
+    # NaN never equals itself, so compare the rows by their repr
+    return repr(a) == repr(b)
+
+
+def compare_nyt(repeat):
+    rows = NYT_SAMPLES * 100
+    legacy = clean_nyt_rows(legacy_cleaning.clean_nyt_html, rows)
+    current = clean_nyt_rows(data_cleaning_util.clean_nyt_html, rows)
+    mismatches = [
+        (row, a, b) for row, a, b in zip(rows, legacy, current) if not same_rows(a, b)
+    ]
+    legacy_time = time_function(
+        lambda rows: clean_nyt_rows(legacy_cleaning.clean_nyt_html, rows), [rows], repeat
+    )
+    current_time = time_function(
+        lambda rows: clean_nyt_rows(data_cleaning_util.clean_nyt_html, rows),
+        [rows],
+        repeat,
+    )
+    report("clean_nyt_html", legacy_time, current_time, mismatches)
+    return not mismatches
+
+
+def apply_pipeline(series):
+    # How the notebooks clean a column, one .apply per step
+    for name in PIPELINE:
+        if name == "clean_unicode_fractions":
+            # normalize_quantities replaces this step and the ones after it
+            return series.apply(data_cleaning_util.normalize_quantities)
+        if name == "unidecode":
+            series = series.apply(unidecode.unidecode)
+        else:
+            series = series.apply(getattr(data_cleaning_util, name))
+    return series
+
+
+def apply_legacy_pipeline(series):
+    # The notebooks before the rewrite, with the old version of every step
+    for name in PIPELINE:
+        if name == "unidecode":
+            series = series.apply(unidecode.unidecode)
+        else:
+            series = series.apply(getattr(legacy_cleaning, name))
+    return series
+
+
+def compare_series(corpus, repeat):
+    series = pd.Series(corpus, dtype=object)
+    expected = apply_pipeline(series)
+    cleaned = data_cleaning_util.clean_series(series, html="epi")
+    mismatches = [
+        (s, a, b) for s, a, b in zip(corpus, expected, cleaned) if a != b
+    ]
+    apply_time = time_function(apply_pipeline, [series], repeat)
+    series_time = time_function(
+        lambda s: data_cleaning_util.clean_series(s, html="epi"), [series], repeat
+    )
+    report("clean_series", apply_time, series_time, mismatches)
+    ok = not mismatches
+    # Timed only, the outputs differ in the KNOWN_DIFFERENCES lines
+    legacy_time = time_function(apply_legacy_pipeline, [series], repeat)
+    print(
+        "{:>23}: {:7.1f} ms -> {:7.1f} ms ({:.1f}x) from the old steps".format(
+            "clean_series",
+            legacy_time * 1000,
+            series_time * 1000,
+            legacy_time / series_time,
+        )
+    )
+
+    frame = pd.DataFrame(NYT_SAMPLES * 1000)
+    expected = frame.apply(data_cleaning_util.clean_nyt_html, axis=1)
+    cleaned = data_cleaning_util.clean_nyt_frame(frame)
+    mismatches = [
+        (row, a, b)
+        for row, a, b in zip(
+            frame.to_dict("records"),
+            expected.to_dict("records"),
+            cleaned.to_dict("records"),
+        )
+        if not same_rows(a, b)
+    ]
+    apply_time = time_function(
+        lambda f: f.apply(data_cleaning_util.clean_nyt_html, axis=1), [frame], repeat
+    )
+    frame_time = time_function(data_cleaning_util.clean_nyt_frame, [frame], repeat)
+    report("clean_nyt_frame", apply_time, frame_time, mismatches)
+    return not mismatches and ok
+
+
+def legacy_quantities(string):
+    string = legacy_cleaning.clean_unicode_fractions(string)
+    string = unidecode.unidecode(string)
+    string = legacy_cleaning.merge_fractions(string)
+    return legacy_cleaning.merge_quantities(string)
+
+
+def quantity_lines():
+    lines = []
+    for a, gap, b in itertools.product(QUANTITY_PARTS, QUANTITY_GAPS, QUANTITY_PARTS):
+        lines.append("{}{}{} cups".format(a, gap, b))
+        lines.extend("{}{}{}{} cups".format(a, gap, b, c) for c in ["-4", " 8", "/3"])
+    return lines
+
+
+def compare_quantities(corpus, repeat):
+    corpus = corpus + quantity_lines()
+    return compare(
+        "normalize_quantities",
+        legacy_quantities,
+        data_cleaning_util.normalize_quantities,
+        corpus,
+        repeat,
+    )
+
+
+def compare_measurements(corpus, model, repeat):
+    # Only this check needs spaCy, the others run without it installed
+    import spacy
+
+    nlp = spacy.load(model)
+    corpus = corpus + MEASUREMENT_SAMPLES
+    series = pd.Series(corpus, dtype=object)
+    # Both versions print the measures they cannot convert
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy = [legacy_cleaning.fix_measurements(s, nlp) for s in corpus]
+        current = data_cleaning_util.fix_measurements_series(series, nlp)
+        mismatches = [(s, a, b) for s, a, b in zip(corpus, legacy, current) if a != b]
+        legacy_time = time_function(
+            lambda s: legacy_cleaning.fix_measurements(s, nlp), corpus, repeat
+        )
+        series_time = time_function(
+            lambda s: data_cleaning_util.fix_measurements_series(s, nlp), [series], repeat
+        )
+    report("fix_measurements", legacy_time, series_time, mismatches)
+    return not mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--corpus",
+        default=path.join(
+            path.dirname(path.abspath(__file__)),
+            "../../data/interim/epi_partial_clean.csv",
+        ),
+        help="CSV file with an input column of ingredient lines",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repeats")
+    parser.add_argument(
+        "--spacy-model",
+        help="Also check fix_measurements, which needs a spaCy model to lemmatize",
+    )
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print("Timing {} ingredient lines".format(len(corpus)))
+    ok = compare_nyt(args.repeat)
+    ok = compare_series(corpus, args.repeat) and ok
+    # Every stage is checked on the lines the stage before it produced
+    for name in PIPELINE:
+        if name == "clean_unicode_fractions":
+            # normalize_quantities replaces this step and the ones after it
+            ok = compare_quantities(corpus, args.repeat) and ok
+        if name == "unidecode":
+            current = unidecode.unidecode
+        else:
+            current = getattr(data_cleaning_util, name)
+            legacy = getattr(legacy_cleaning, name)
+            ok = compare(name, legacy, current, corpus, args.repeat) and ok
+        corpus = [current(s) for s in corpus]
+    if args.spacy_model:
+        ok = compare_measurements(corpus, args.spacy_model, args.repeat) and ok
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,81 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import time
+from os import path
+
+from http_cache import ResponseCache
+from recipe_extract import RECIPE_FIELDS, extract_recipe, scraper_class
+
+
+def legacy_extract(url, html):
+    # What get_recipe did before: an html.parser parse inside the scraper's
+    # constructor followed by one accessor call per field
+    scraper = scraper_class(url)(io.BytesIO(html), test=True)
+    scraper.testing_mode = False
+    recipe = {}
+    for field in RECIPE_FIELDS:
+        try:
+            recipe[field] = getattr(scraper, field)()
+        except AttributeError:
+            recipe[field] = None
+    return recipe
+
+
+def cached_pages(cache, host, limit):
+    index_dir = path.join(cache.directory, "index")
+    count = 0
+    for root, _, files in os.walk(index_dir):
+        for name in files:
+            with open(path.join(root, name), "r") as f:
+                entry = json.load(f)
+            if host not in entry["url"]:
+                continue
+            try:
+                scraper_class(entry["url"])
+            except NotImplementedError:
+                continue
+            yield entry["url"], cache.body(entry)
+            count += 1
+            if count >= limit:
+                return
+
+
+def time_call(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="", help="Only time pages from this host")
+    parser.add_argument("--limit", type=int, default=200, help="Number of pages")
+    parser.add_argument("-v", action="store_true", help="Print every page")
+    args = parser.parse_args()
+
+    cache = ResponseCache(path.join("../../data/raw", "http_cache"))
+    legacy_times, fast_times = [], []
+    for url, html in cached_pages(cache, args.host, args.limit):
+        legacy_times.append(time_call(legacy_extract, url, html))
+        fast_times.append(time_call(extract_recipe, url, html))
+        if args.v:
+            print(
+                "{:8.1f} ms {:8.1f} ms  {}".format(
+                    legacy_times[-1] * 1000, fast_times[-1] * 1000, url
+                )
+            )
+
+    if not legacy_times:
+        print("No cached recipe pages found, run a crawl first")
+    else:
+        print("Timed {} pages".format(len(legacy_times)))
+        for name, times in [("html.parser", legacy_times), ("single parse", fast_times)]:
+            print(
+                "{:>12}: mean {:.1f} ms, median {:.1f} ms per page".format(
+                    name, statistics.mean(times) * 1000, statistics.median(times) * 1000
+                )
+            )
+        print("Speedup: {:.1f}x".format(sum(legacy_times) / sum(fast_times)))
@@ -0,0 +1,93 @@
+import argparse
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+from os import path
+
+import pandas as pd
+
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), "../.."))
+from src.data import data_cleaning_util
+
+
+def clean_chunk(job):
+    """
+    Pool worker: cleans one shard and sends back its number and timing
+    """
+    i, chunk, html = job
+    start = time.perf_counter()
+    cleaned = data_cleaning_util.clean_series(chunk, html=html)
+    return i, cleaned, time.perf_counter() - start
+
+
+def chunks(series, chunk_size):
+    for start in range(0, len(series), chunk_size):
+        yield series.iloc[start : start + chunk_size]
+
+
+def clean_parallel(series, workers=None, chunk_size=10000, html=None, verbose=True):
+    """
+    Splits `series` into shards of `chunk_size` lines, runs clean_series on
+    each one in a process pool and returns the cleaned Series in the
+    original order
+    """
+    jobs = [(i, chunk, html) for i, chunk in enumerate(chunks(series, chunk_size))]
+    if not jobs:
+        return series.copy()
+    start = time.perf_counter()
+    cleaned = []
+    with Pool(workers or cpu_count()) as pool:
+        # imap keeps the shards in order while the pool works ahead
+        for i, chunk, elapsed in pool.imap(clean_chunk, jobs):
+            cleaned.append(chunk)
+            if verbose:
+                print(
+                    "chunk {}/{}: {} lines in {:.2f}s ({:.0f} lines/s)".format(
+                        i + 1,
+                        len(jobs),
+                        len(chunk),
+                        elapsed,
+                        len(chunk) / elapsed if elapsed else 0,
+                    )
+                )
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(
+            "Cleaned {} lines in {:.2f}s ({:.0f} lines/s)".format(
+                len(series), elapsed, len(series) / elapsed if elapsed else 0
+            )
+        )
+    return pd.concat(cleaned)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the ingredient cleaning chain over a CSV column in parallel"
+    )
+    parser.add_argument("input", help="CSV file of ingredients")
+    parser.add_argument("output", help="CSV file to write the cleaned table to")
+    parser.add_argument("--column", default="input", help="Column to clean")
+    parser.add_argument(
+        "--workers", type=int, default=cpu_count(), help="Worker processes"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=10000, help="Lines per shard"
+    )
+    parser.add_argument(
+        "--html",
+        choices=["epi", "nyt"],
+        help="Strip the html of the Epicurious or NYT data first",
+    )
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.input, index_col=0)
+    html = args.html
+    if html == "nyt":
+        # The NYT html cleaning touches several columns and is already
+        # vectorized, so it runs once over the whole table
+        data = data_cleaning_util.clean_nyt_frame(data)
+        html = None
+    data[args.column] = clean_parallel(
+        data[args.column], args.workers, args.chunk_size, html
+    )
+    data.to_csv(args.output)
@@ -0,0 +1,150 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class CrawlEngine:
+    """
+    Asyncio crawl engine that pipelines listing page fetches into recipe
+    page fetches. Blocking fetch and scrape calls are run on a thread pool
+    while the event loop keeps at most `per_host` requests in flight for
+    any single host.
+    """
+
+    def __init__(self, fetch, per_host=4, queue_size=None):
+        self.fetch = fetch
+        self.per_host = per_host
+        self.queue_size = queue_size or per_host * 8
+        self._host_limits = {}
+        self._executor = None
+
+    def _limit(self, url):
+        host = urlparse(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _run(self, url, func, *args):
+        # Every blocking call that touches the network counts against the
+        # limit of the host it talks to
+        loop = asyncio.get_running_loop()
+        async with self._limit(url):
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _parse(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _listing_worker(self, page_queue, parse_links, recipe_queue, state):
+        while True:
+            page_key, url = await page_queue.get()
+            try:
+                try:
+                    html = await self._run(url, self.fetch, url)
+                    links = await self._parse(parse_links, html)
+                except Exception as e:
+                    print("Could not parse page {} ({})".format(url, e))
+                    if state["on_page_error"] is not None:
+                        state["on_page_error"](page_key)
+                    continue
+                print("Read {} recipe links from {}".format(len(links), url))
+                if state["next_page"] is not None:
+                    # Paginated listings are followed as soon as a page is read,
+                    # so every section of an index is walked concurrently
+                    next_page = state["next_page"](page_key, links)
+                    if next_page is not None:
+                        page_queue.put_nowait(next_page)
+                await self._enqueue(page_key, links, recipe_queue, state)
+            finally:
+                page_queue.task_done()
+
+    async def _enqueue(self, page_key, links, recipe_queue, state):
+        links = [r for r in links if r not in state["seen"]]
+        state["seen"].update(links)
+        state["pending"][page_key] = len(links)
+        if not links:
+            self._page_done(page_key, state)
+        for r in links:
+            await recipe_queue.put((page_key, r))
+
+    async def _recipe_worker(self, scrape, recipe_queue, on_result, state):
+        while True:
+            page_key, url = await recipe_queue.get()
+            try:
+                recipe = await self._run(url, scrape, url)
+                on_result(url, recipe)
+            except Exception as e:
+                print("Could not scrape URL {} ({})".format(url, e))
+            finally:
+                state["pending"][page_key] -= 1
+                if state["pending"][page_key] == 0:
+                    self._page_done(page_key, state)
+                recipe_queue.task_done()
+
+    def _page_done(self, page_key, state):
+        del state["pending"][page_key]
+        if state["on_page_done"] is not None:
+            state["on_page_done"](page_key)
+
+    async def crawl(
+        self,
+        scrape,
+        on_result,
+        pages=(),
+        parse_links=None,
+        links=None,
+        on_page_done=None,
+        on_page_error=None,
+        next_page=None,
+        seen=None,
+    ):
+        """
+        Crawls every (page_key, url) in `pages`, reading recipe links out of
+        each listing page with `parse_links(html)`, and scrapes every recipe
+        with `scrape(url)` as soon as its link is known. Recipe links that
+        are already known can be passed as a {page_key: [urls]} dict in
+        `links`. `on_result(url, recipe)` is called for every recipe and
+        `on_page_done(page_key)` once all recipes of a page are finished,
+        `on_page_error(page_key)` when a listing page could not be read.
+        `next_page(page_key, links)` may return the (page_key, url) of the
+        listing page that follows, or None at the end of a section. Recipe
+        urls in `seen` are skipped.
+        """
+        self._executor = ThreadPoolExecutor(self.per_host * 4)
+        state = {
+            "seen": set(seen) if seen else set(),
+            "pending": {},
+            "on_page_done": on_page_done,
+            "on_page_error": on_page_error,
+            "next_page": next_page,
+        }
+        recipe_queue = asyncio.Queue(self.queue_size)
+        recipe_workers = [
+            asyncio.ensure_future(
+                self._recipe_worker(scrape, recipe_queue, on_result, state)
+            )
+            for _ in range(self.per_host * 2)
+        ]
+        listing_workers = []
+        try:
+            if links:
+                for page_key, recipe_links in links.items():
+                    await self._enqueue(page_key, recipe_links, recipe_queue, state)
+            page_queue = asyncio.Queue()
+            for page in pages:
+                page_queue.put_nowait(page)
+            listing_workers = [
+                asyncio.ensure_future(
+                    self._listing_worker(page_queue, parse_links, recipe_queue, state)
+                )
+                for _ in range(self.per_host)
+            ]
+            await page_queue.join()
+            await recipe_queue.join()
+        finally:
+            for w in recipe_workers + listing_workers:
+                w.cancel()
+            self._executor.shutdown(wait=False)
+
+    def run(self, *args, **kwargs):
+        return asyncio.run(self.crawl(*args, **kwargs))
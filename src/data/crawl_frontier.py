@@ -0,0 +1,153 @@
+import sqlite3
+
+
+class CrawlFrontier:
+    """
+    On-disk crawl frontier backed by SQLite. It records every listing page
+    and recipe url a crawl has discovered together with its fetch status and
+    retry count, so a killed crawl can resume where it stopped. Settled
+    recipe urls are mirrored in the `seen` set for constant-time lookups.
+    """
+
+    def __init__(self, filename, site, max_retries=3):
+        self.site = site
+        self.max_retries = max_retries
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                site TEXT, page_key TEXT, status TEXT, retries INTEGER,
+                PRIMARY KEY (site, page_key)
+            );
+            CREATE TABLE IF NOT EXISTS recipes (
+                url TEXT PRIMARY KEY, site TEXT, page_key TEXT, status TEXT,
+                retries INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                site TEXT, key TEXT, value TEXT, PRIMARY KEY (site, key)
+            );
+            """
+        )
+        self.seen = set(
+            r[0]
+            for r in self.conn.execute(
+                "SELECT url FROM recipes WHERE site = ? AND "
+                "(status = 'done' OR retries >= ?)",
+                (site, max_retries),
+            )
+        )
+        self.pages_done = set(
+            r[0]
+            for r in self.conn.execute(
+                "SELECT page_key FROM pages WHERE site = ? AND "
+                "(status = 'done' OR retries >= ?)",
+                (site, max_retries),
+            )
+        )
+
+    def reset(self):
+        for table in ["pages", "recipes", "meta"]:
+            self.conn.execute("DELETE FROM {} WHERE site = ?".format(table), (self.site,))
+        self.conn.commit()
+        self.seen = set()
+        self.pages_done = set()
+
+    def is_page_done(self, page_key):
+        return str(page_key) in self.pages_done
+
+    def add_links(self, page_key, urls):
+        """
+        Records the recipe urls found on a listing page and returns the ones
+        that still need to be scraped
+        """
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO recipes VALUES (?, ?, ?, 'pending', 0)",
+            [(url, self.site, str(page_key)) for url in urls],
+        )
+        return [url for url in urls if url not in self.seen]
+
+    def _add_recipe(self, url):
+        # Recipes scraped without add_links still get a row of their own
+        self.conn.execute(
+            "INSERT OR IGNORE INTO recipes VALUES (?, ?, NULL, 'pending', 0)",
+            (url, self.site),
+        )
+
+    def recipe_done(self, url):
+        self._add_recipe(url)
+        self.conn.execute(
+            "UPDATE recipes SET status = 'done' WHERE url = ?", (url,)
+        )
+        self.seen.add(url)
+
+    def recipe_failed(self, url):
+        self._add_recipe(url)
+        self.conn.execute(
+            "UPDATE recipes SET status = 'failed', retries = retries + 1 "
+            "WHERE url = ?",
+            (url,),
+        )
+        retries = self.conn.execute(
+            "SELECT retries FROM recipes WHERE url = ?", (url,)
+        ).fetchone()
+        if retries is not None and retries[0] >= self.max_retries:
+            self.seen.add(url)
+
+    def page_done(self, page_key):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, 'done', "
+            "COALESCE((SELECT retries FROM pages WHERE site = ? AND page_key = ?), 0))",
+            (self.site, str(page_key), self.site, str(page_key)),
+        )
+        self.pages_done.add(str(page_key))
+
+    def page_failed(self, page_key):
+        self.conn.execute(
+            "INSERT OR IGNORE INTO pages VALUES (?, ?, 'failed', 0)",
+            (self.site, str(page_key)),
+        )
+        self.conn.execute(
+            "UPDATE pages SET status = 'failed', retries = retries + 1 "
+            "WHERE site = ? AND page_key = ?",
+            (self.site, str(page_key)),
+        )
+        retries = self.conn.execute(
+            "SELECT retries FROM pages WHERE site = ? AND page_key = ?",
+            (self.site, str(page_key)),
+        ).fetchone()
+        if retries[0] >= self.max_retries:
+            self.pages_done.add(str(page_key))
+
+    def links(self):
+        """
+        Returns every discovered recipe url grouped by the page it was found on
+        """
+        links = {}
+        for page_key, url in self.conn.execute(
+            "SELECT page_key, url FROM recipes WHERE site = ? AND page_key IS NOT NULL "
+            "ORDER BY rowid",
+            (self.site,),
+        ):
+            links.setdefault(page_key, []).append(url)
+        return links
+
+    def get_meta(self, key):
+        value = self.conn.execute(
+            "SELECT value FROM meta WHERE site = ? AND key = ?", (self.site, key)
+        ).fetchone()
+        return value[0] if value is not None else None
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?, ?)", (self.site, key, value)
+        )
+        self.conn.commit()
+
+    def commit(self):
+        # Page and recipe updates are only written here, so the caller can
+        # commit after the recipes they stand for are safely on disk
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
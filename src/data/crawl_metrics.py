@@ -0,0 +1,158 @@
+import json
+import time
+from urllib.parse import urlparse
+
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+
+PAGES = Counter("crawl_pages_total", "Listing pages crawled", ["site"])
+RECIPES = Counter("crawl_recipes_total", "Recipes scraped", ["site"])
+FETCH_SECONDS = Histogram("crawl_fetch_seconds", "Page fetch latency", ["host"])
+PARSE_SECONDS = Histogram("crawl_parse_seconds", "Recipe extraction latency")
+BYTES = Counter("crawl_bytes_total", "Response bytes downloaded", ["host"])
+ERRORS = Counter("crawl_errors_total", "Errors by exception type", ["type"])
+MISSING_FIELDS = Counter(
+    "crawl_missing_fields_total", "Scraped recipes missing a field", ["field"]
+)
+
+_started = time.time()
+# Pool workers have registries of their own that /metrics and the summary
+# never read, so they keep their observations here and send them back to
+# the parent with their results, see start_buffer and replay
+_buffer = None
+
+
+def start(port):
+    """
+    Serves the metrics in the Prometheus text format on localhost:`port`
+    """
+    global _started
+    _started = time.time()
+    if port:
+        start_http_server(port, addr="127.0.0.1")
+
+
+def observe_fetch(url, seconds, nbytes):
+    _record("fetch", urlparse(url).netloc, seconds, nbytes)
+
+
+def observe_parse(seconds, recipe):
+    missing = [field for field, value in recipe.items() if value in (None, "", [])]
+    _record("parse", seconds, missing)
+
+
+def record_error(e):
+    _record("error", type(e).__name__)
+
+
+def _fetch(host, seconds, nbytes):
+    FETCH_SECONDS.labels(host).observe(seconds)
+    BYTES.labels(host).inc(nbytes)
+
+
+def _parse(seconds, missing):
+    PARSE_SECONDS.observe(seconds)
+    for field in missing:
+        MISSING_FIELDS.labels(field).inc()
+
+
+def _error(name):
+    ERRORS.labels(name).inc()
+
+
+_OBSERVERS = {"fetch": _fetch, "parse": _parse, "error": _error}
+
+
+def _record(kind, *args):
+    if _buffer is None:
+        _OBSERVERS[kind](*args)
+    else:
+        _buffer.append((kind,) + args)
+
+
+def start_buffer():
+    """
+    Keeps this process's observations for take_buffer instead of recording
+    them, the Pool initializer of the --multi workers
+    """
+    global _buffer
+    _buffer = []
+
+
+def take_buffer():
+    """
+    Returns and clears the observations kept since the last call
+    """
+    global _buffer
+    events, _buffer = _buffer, []
+    return events
+
+
+def replay(events):
+    """
+    Records the observations a worker sent back in this process's registry
+    """
+    for kind, *args in events:
+        _OBSERVERS[kind](*args)
+
+
+def record_page(site):
+    PAGES.labels(site).inc()
+
+
+def record_recipe(site):
+    RECIPES.labels(site).inc()
+
+
+def _total(name):
+    # Sum a metric's samples over all of its label values
+    return sum(
+        s.value
+        for metric in REGISTRY.collect()
+        for s in metric.samples
+        if s.name == name
+    )
+
+
+def _by_label(name, label):
+    return {
+        s.labels[label]: s.value
+        for metric in REGISTRY.collect()
+        for s in metric.samples
+        if s.name == name
+    }
+
+
+def summary():
+    elapsed = time.time() - _started
+    pages = _total("crawl_pages_total")
+    recipes = _total("crawl_recipes_total")
+    fetches = _total("crawl_fetch_seconds_count")
+    parses = _total("crawl_parse_seconds_count")
+    return {
+        "elapsed_seconds": elapsed,
+        "pages": pages,
+        "recipes": recipes,
+        "pages_per_second": pages / elapsed if elapsed else 0,
+        "recipes_per_second": recipes / elapsed if elapsed else 0,
+        "bytes": _total("crawl_bytes_total"),
+        "mean_fetch_seconds": _total("crawl_fetch_seconds_sum") / fetches
+        if fetches
+        else None,
+        "mean_parse_seconds": _total("crawl_parse_seconds_sum") / parses
+        if parses
+        else None,
+        "errors": _by_label("crawl_errors_total", "type"),
+        "missing_field_share": {
+            field: count / parses
+            for field, count in _by_label(
+                "crawl_missing_fields_total", "field"
+            ).items()
+        }
+        if parses
+        else {},
+    }
+
+
+def write_summary(filename):
+    with open(filename, "w") as f:
+        json.dump(summary(), f, indent=4, sort_keys=True)
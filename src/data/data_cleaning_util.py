@@ -1,20 +1,25 @@
-from collections import Counter
+from collections import Counter, namedtuple
 import decimal
 import re
 from fractions import Fraction
 import sys
 import unicodedata
 import pandas as pd
-from sklearn.model_selection import train_test_split
-import spacy
 
 sys.path.append("..")
-from src.features import create_features
+from src.features import unit_conversion
 import unidecode
 
 decimal.getcontext().rounding = decimal.ROUND_HALF_UP
 
 
+SEE_RECIPE_LINK = re.compile(r"\(?<.*see\s*recipe.*>\)?")
+SEE_LINK_RECIPE = re.compile(r"\(?\s*(see)\s*?<.*recipe.*>\)?")
+SEE_RECIPE = re.compile(r"see recipe")
+HTML_TAG = re.compile(r"<.*?>")
+EPI_RECIPE_LINK = re.compile(r"epi\:recipeLink id\=\"\"\d+\"\"<")
+
+
 def clean_nyt_html(row, verbose=False):
     """
     This will replace all html tags that were not stripped
@@ -26,42 +31,25 @@ def clean_nyt_html(row, verbose=False):
         if row[col] == row[col]:
             try:
                 # this will remove all: <a href=...>see recipe</a>
-                match = re.findall(r"\(?<.*see\s*recipe.*>\)?", row[col])
-                if match:
-                    for m in match:
-                        row[col] = re.sub(r"\(?<.*see\s*recipe.*>\)?", "", row[col])
-                        if col == "input" and row["comment"] == row["comment"]:
-                            row["comment"] = re.sub(r"see recipe", "", row["comment"])
+                if SEE_RECIPE_LINK.search(row[col]):
+                    row[col] = SEE_RECIPE_LINK.sub("", row[col])
+                    if col == "input" and row["comment"] == row["comment"]:
+                        row["comment"] = SEE_RECIPE.sub("", row["comment"])
             except TypeError:
                 print("ERROR: Removing <see recipe>, " + col + " ", row)
             try:
                 # this will remove all: see <a href=...>recipe</a>
-                match = re.findall(r"\(?\s*(see)\s*?<.*recipe.*>\)?", row[col])
-                if match:
-                    for m in match:
-                        row[col] = re.sub(
-                            r"\(?\s*(see)\s*?<.*recipe.*>\)?", "", row[col]
-                        )
-                        if col == "input" and row["comment"] == row["comment"]:
-                            row["comment"] = re.sub(r"see recipe", "", row["comment"])
+                if SEE_LINK_RECIPE.search(row[col]):
+                    row[col] = SEE_LINK_RECIPE.sub("", row[col])
+                    if col == "input" and row["comment"] == row["comment"]:
+                        row["comment"] = SEE_RECIPE.sub("", row["comment"])
             except TypeError:
                 print("ERROR: Removing see <recipe>, " + col + " ", row)
 
             # This will remove all <span> and misc <a href=...>...</a>
-            match = re.findall(r"<.*?>", row[col])
-            if match:
-                for m in match:
-                    row[col] = re.sub(r"<.*?>", "", row[col])
-            # this will remove all un-escapped '\n' from the original html
-            match = re.findall(r"\\n", row[col])
-            if match:
-                for m in match:
-                    row[col] = re.sub(r"\\n", " ", row[col])
-            # this will remove all un-escapped '\t' from the original html
-            match = re.findall(r"\\t", row[col])
-            if match:
-                for m in match:
-                    row[col] = re.sub(r"\\t", " ", row[col])
+            row[col] = HTML_TAG.sub("", row[col])
+            # this will remove all un-escapped '\n' and '\t' from the original html
+            row[col] = row[col].replace("\\n", " ").replace("\\t", " ")
             # if the column is now blank becasue of what we removed, set it
             # to NaN so pandas can handle it easier
             if not row[col]:
@@ -73,21 +61,9 @@ def clean_nyt_html(row, verbose=False):
 
 def clean_epi_html(ingredient):
     # this will remove all: epi:recipelink stuff
-    match = re.findall(r"epi\:recipeLink id\=\"\"\d+\"\"<", ingredient)
-    if match:
-        for m in match:
-            ingredient = re.sub(r"epi\:recipeLink id\=\"\"\d+\"\"<", "", ingredient)
-
-    # this will remove all un-escapped '\n' from the original html
-    match = re.findall(r"\\n", ingredient)
-    if match:
-        for m in match:
-            ingredient = re.sub(r"\\n", " ", ingredient)
-    # this will remove all un-escapped '\t' from the original html
-    match = re.findall(r"\\t", ingredient)
-    if match:
-        for m in match:
-            ingredient = re.sub(r"\\t", " ", ingredient)
+    ingredient = EPI_RECIPE_LINK.sub("", ingredient)
+    # this will remove all un-escapped '\n' and '\t' from the original html
+    ingredient = ingredient.replace("\\n", " ").replace("\\t", " ")
     # if the column is now blank becasue of what we removed, set it
     # to NaN so pandas can handle it easier
     if not ingredient:
@@ -97,75 +73,172 @@ def clean_epi_html(ingredient):
     return ingredient
 
 
-def fix_spelling(string):
-    if string == string:
-        string = re.sub(r"([Cc])(hipolte|hipottle)", r"\1hipotle", string)
-        string = re.sub(
-            r"([Ff])(ritata|rittatta|ritatta|ritartar)", r"\1rittata", string
-        )
-        string = re.sub(r"([Cc])reme\s[Ff](resh|raishe)", r"\1reme fraiche", string)
-        string = re.sub(r"([Mm])(ascapone|ascaprone)", r"\1ascarpone", string)
-        string = re.sub(
-            r"([Bb])(russel|russle)\s[Ss]prout", r"\1russels sprout", string
+# Spelling, html entity and edge case rules applied in order by fix_spelling
+SPELLING_RULES = [
+    (r"([Cc])(hipolte|hipottle)", r"\1hipotle"),
+    (r"([Ff])(ritata|rittatta|ritatta|ritartar)", r"\1rittata"),
+    (r"([Cc])reme\s[Ff](resh|raishe)", r"\1reme fraiche"),
+    (r"([Mm])(ascapone|ascaprone)", r"\1ascarpone"),
+    (r"([Bb])(russel|russle)\s[Ss]prout", r"\1russels sprout"),
+    (r"([Gg])nocci", r"\1nocchi"),
+    (r"([Mm])(accaroni|acarroni)", r"\1acaroni"),
+    (r"([Mm])(acaroon|accaron|acarron)", r"\1acaron"),
+    (r"([Ff])(ettuccini|ettucine|ettucchine)", r"\1ettuccine"),
+    (r"([Ee])xpresso", r"\1spresso"),
+    (r"([Mm])(ozzarrella|ozarela|ozzarela )", r"\1ozzarella"),
+    (r"([Ss])herbert", r"\1herbet"),
+    (r"([Cc])ardamon", r"\1ardamom"),
+    (r"([Ll])inguini", r"\1inguine"),
+    (r"([Ll])iquer", r"\1iqueur"),
+    (r"([Ww])on\ston", r"\1onton"),
+    (r"([Cc])hile", r"\1hili"),
+    (r"([Cc])hilies", r"\1hilis"),
+    (r"(\&amp\;|\&)e(acute|grave)\;", "e"),
+    (r"(\&amp\;|\&)icirc\;", "i"),
+    (r"(\&amp\;|\&)ucirc\;", "u"),
+    (r"(\&amp\;|\&)\#231\;", "c"),
+    (r"(\&amp\;|\&)rsquo\;", "'"),
+    (r"(\&amp\;|\&)ntilde\;", "n"),
+    (r"redpepper", "red pepper"),
+    (r"blackpepper", "black pepper"),
+    (r"roastedalmonds", "roasted almonds"),
+    (r"XXshiitake", "shiitake"),
+    # Handling misc edge case
+    (r"1 1\/2\½", "1 1/2"),
+    (r"1\#3", "1/3"),
+    (r"1\#12", "1 12"),
+]
+SPELLING_PATTERNS = [(re.compile(p), r) for p, r in SPELLING_RULES]
+
+
+def rule_first_chars(pattern):
+    # Rules start with either a character class or a literal character
+    match = re.match(r"\(?\[(\w+)\]", pattern)
+    if match:
+        return match.group(1)
+    return re.match(r"\(?\\?(.)", pattern).group(1)
+
+
+def first_chars_class(rules):
+    return "[{}]".format(
+        re.escape("".join(sorted(set("".join(rule_first_chars(p) for p, _ in rules)))))
+    )
+
+
+def compile_rule_check(rules):
+    """
+    Compiles one pattern that matches wherever any rule of the table does.
+    The leading lookahead lets the regex engine skip every position no rule
+    can start at.
+    """
+    return re.compile(
+        "(?={})(?:{})".format(
+            first_chars_class(rules), "|".join("(?:{})".format(p) for p, _ in rules)
         )
-        string = re.sub(r"([Gg])nocci", r"\1nocchi", string)
-        string = re.sub(r"([Mm])(accaroni|acarroni)", r"\1acaroni", string)
-        string = re.sub(r"([Mm])(acaroon|accaron|acarron)", r"\1acaron", string)
-        string = re.sub(
-            r"([Ff])(ettuccini|ettucine|ettucchine)", r"\1ettuccine", string
+    )
+
+
+def compile_rule_scanners(rules):
+    """
+    For every position k in a rule table, compiles one zero-width pattern
+    that finds, in a single scan, the lowest numbered rule >= k that matches
+    anywhere in a string
+    """
+    return [
+        re.compile(
+            "(?={})(?=".format(first_chars_class(rules[k:]))
+            + "|".join(
+                "(?P<r{}>{})".format(i, rules[i][0]) for i in range(k, len(rules))
+            )
+            + ")"
         )
-        string = re.sub(r"([Ee])xpresso", r"\1spresso", string)
-        string = re.sub(r"([Mm])(ozzarrella|ozarela|ozzarela )", r"\1ozzarella", string)
-        string = re.sub(r"([Ss])herbert", r"\1herbet", string)
-        string = re.sub(r"([Cc])ardamon", r"\1ardamom", string)
-        string = re.sub(r"([Ll])inguini", r"\1inguine", string)
-        string = re.sub(r"([Ll])iquer", r"\1iqueur", string)
-        string = re.sub(r"([Ww])on\ston", r"\1onton", string)
-        string = re.sub(r"([Cc])hile", r"\1hili", string)
-        string = re.sub(r"([Cc])hilies", r"\1hilis", string)
-        string = re.sub(r"(\&amp\;|\&)e(acute|grave)\;", "e", string)
-        string = re.sub(r"(\&amp\;|\&)icirc\;", "i", string)
-        string = re.sub(r"(\&amp\;|\&)ucirc\;", "u", string)
-        string = re.sub(r"(\&amp\;|\&)\#231\;", "c", string)
-        string = re.sub(r"(\&amp\;|\&)rsquo\;", "'", string)
-        string = re.sub(r"(\&amp\;|\&)ntilde\;", "n", string)
-        string = re.sub(r"redpepper", "red pepper", string)
-        string = re.sub(r"blackpepper", "black pepper", string)
-        string = re.sub(r"roastedalmonds", "roasted almonds", string)
-        string = re.sub(r"XXshiitake", "shiitake", string)
-        # Handling misc edge case
-        string = re.sub(r"1 1\/2\½", "1 1/2", string)
-        string = re.sub(r"1\#3", "1/3", string)
-        string = re.sub(r"1\#12", "1 12", string)
+        for k in range(len(rules))
+    ]
+
+
+SPELLING_CHECK = compile_rule_check(SPELLING_RULES)
+SPELLING_SCANNERS = compile_rule_scanners(SPELLING_RULES)
+
+
+def first_matching_rule(scanners, string, k=0):
+    first = None
+    for m in scanners[k].finditer(string):
+        i = int(m.lastgroup[1:])
+        if first is None or i < first:
+            first = i
+            if first == k:
+                break
+    return first
+
+
+def fix_spelling(string):
+    """
+    Applies SPELLING_RULES in order. Most strings match no rule at all and
+    are returned after a single scan. Otherwise each scan finds the next
+    rule that matches and only that rule is run, which gives the same output
+    as running every rule in turn.
+    """
+    if string == string and SPELLING_CHECK.search(string):
+        i = first_matching_rule(SPELLING_SCANNERS, string)
+        while i is not None:
+            pattern, replacement = SPELLING_PATTERNS[i]
+            string = pattern.sub(replacement, string)
+            if i + 1 == len(SPELLING_SCANNERS):
+                break
+            i = first_matching_rule(SPELLING_SCANNERS, string, i + 1)
 
     return string
 
 
+# Character replacements done by fix_characters. No replacement produces a
+# character that another one replaces, so they can all happen in one pass.
+CHARACTER_TABLE = str.maketrans(
+    {
+        "\xa0": " ",
+        "\x90": "",
+        "×": "x",
+        **{c: "" for c in "!*|`@+?\ufffd™‿•®§¤[]\u2028"},
+        "‘": "''",
+        "’": "''",
+        **{c: '"' for c in "“”″‟"},
+        "&": "and",
+        "⁄": "/",
+        # The following characters only appear a very small number of times each in the data and are removed
+        "‱": "n",
+    }
+)
+
+
 def fix_characters(string):
     if string == string:
-        if "\xa0" in string:
-            string = string.replace("\xa0", " ")
-        if "\x90" in string:
-            string = string.replace("\x90", "")
-        if "×" in string:
-            string = string.replace("×", "x")
         # Wait to process hyphens until after ingredient ranges are processed.
         # string = re.sub(r"(?<!(?:[^\d]))[\–\—\‐\‑\-](?=(?:[^\d]))", " ", string)
-        string = re.sub(r"[\!\*\|\`\@\+\?\�\™\‿\•\®\§\¤\[\]\u2028]", "", string)
-        string = re.sub(r"[\‘|\’]", "''", string)
-        string = re.sub(r"[\“\”\″\‟]", '"', string)
-        string = re.sub(r"\&", "and", string)
-        if "⁄" in string:
-            string = string.replace("⁄", "/")
-        # The following characters only appear a very small number of times each in the data and are removed
-
-        if "‱" in string:
-            string = string.replace("‱", "n")
-        strin = string.replace("  ", " ")
+        string = string.translate(CHARACTER_TABLE)
     return string
 
 
-# Qty in data are rounded up to two decimal places
+# The loose patterns also match an abbreviation at the end of the line. The
+# old loops took their groups from them and replaced with the strict ones,
+# which is how the dot of a line ending in "oz." or "ml." got dropped.
+OUNCE_LOOSE = re.compile(r"([^\w])oz\.?([^\w])?")
+OUNCE = re.compile(r"([^\w])oz\.?([^\w])")
+POUND = re.compile(r"([^\w])lbs?\.?([^\w])?")
+MILLILITER_LOOSE = re.compile(r"([^\w])ml\.?([^\w])?")
+MILLILITER = re.compile(r"([^\w])ml\.?([^\w])")
+GRAM = re.compile(r"(\d+)\s?g\.?([^\w])")
+TABLESPOON = re.compile(r"[Tt]bsp\.*")
+TEASPOON = re.compile(r"[Tt]sp\.*")
+
+
+def replace_unit(loose, strict, unit, string):
+    """
+    Replaces the abbreviation like the loops of the cleaning notebooks: the
+    n-th loose match gives the characters around `unit` for the first strict
+    match left in the string
+    """
+    for before, after in loose.findall(string):
+        string = strict.sub(lambda m: before + unit + after, string, 1)
+    return string
 
 
 def fix_abbreviations(string):
@@ -173,57 +246,24 @@ def fix_abbreviations(string):
     Converts instances of oz., ml., and g. to ounce and gram respectively
     """
     if string == string:
-        match = re.findall(r"([^\w])oz\.?([^\w])?", string)
-        if match:
-            for m in match:
-                if len(m) == 1:
-                    string = re.sub(r"([^\w])oz\.?([^\w])", m[0] + "ounce", string, 1)
-                else:
-                    string = re.sub(
-                        r"([^\w])oz\.?([^\w])", m[0] + "ounce" + m[1], string, 1
-                    )
-        match = re.findall(r"([^\w])lbs?\.?([^\w])?", string)
-        if match:
-            for m in match:
-                if len(m) == 1:
-                    string = re.sub(
-                        r"([^\w])lbs?\.?([^\w])?", m[0] + "pound", string, 1
-                    )
-                else:
-                    string = re.sub(
-                        r"([^\w])lbs?\.?([^\w])?", m[0] + "pound" + m[1], string, 1
-                    )
+        # The substring tests skip the regex on the many lines without the
+        # abbreviation
+        if "oz" in string:
+            string = replace_unit(OUNCE_LOOSE, OUNCE, "ounce", string)
+        if "lb" in string:
+            string = replace_unit(POUND, POUND, "pound", string)
         # replace ml. with milliliter
-        match = re.findall(r"([^\w])ml\.?([^\w])?", string)
-        if match:
-            for m in match:
-                if len(m) == 1:
-                    string = re.sub(
-                        r"([^\w])ml\.?([^\w])", m[0] + "milliliter", string, 1
-                    )
-                else:
-                    string = re.sub(
-                        r"([^\w])ml\.?([^\w])", m[0] + "milliliter" + m[1], string, 1
-                    )
+        if "ml" in string:
+            string = replace_unit(MILLILITER_LOOSE, MILLILITER, "milliliter", string)
         # replace g. with gram
-        match = re.findall(r"(\d+)\s?g\.?([^\w])", string)
-        if match:
-            for m in match:
-                string = re.sub(
-                    r"(\d+)\s?g\.?([^\w])", m[0] + " gram" + m[1], string, 1
-                )
-
+        if "g" in string:
+            string = GRAM.sub(r"\1 gram\2", string)
         # replace tbsp with tablespoon
-        match = re.findall(r"[Tt]bsp\.*", string)
-        if match:
-            for m in match:
-                string = re.sub(r"[Tt]bsp\.*", "tablespoon", string, 1)
-
+        if "bsp" in string:
+            string = TABLESPOON.sub("tablespoon", string)
         # replace tsp with teaspoon
-        match = re.findall(r"[Tt]sp\.*", string)
-        if match:
-            for m in match:
-                string = re.sub(r"[Tt]sp\.*", "teaspoon", string, 1)
+        if "sp" in string:
+            string = TEASPOON.sub("teaspoon", string)
     return string
 
 
@@ -241,31 +281,45 @@ numbers = {
     "dozen": 12,
 }
 
+NUMERIC_PHRASES = [
+    (re.compile(r"(\sone and a half|\sone and one[\s\-]half)"), " 1.5"),
+    (re.compile(r"one and one[\s\-]quarter"), "1.25"),
+    (re.compile(r"two and one[\s\-]quarter"), "2.25"),
+    (re.compile(r"two and one[\s\-]half"), "2.5"),
+    (re.compile(r"three and a half"), "3.5"),
+]
+NUMERIC_WORD = re.compile(
+    r"(?<!(?:[^\w]))([Oo]ne|[Tt]wo|[Tt]hree|[Ff]our|[Ff]ive|[Ss]ix|[Ss]even|[Ee]ight|[Nn]ine|[Tt]en|[Dd]ozen)(?=(?:[^\w]))"
+)
 
-def fix_numeric_words(ingredient):
 
-    ingredient = re.sub(
-        r"(\sone and a half|\sone and one[\s\-]half)", " 1.5", ingredient
-    )
-    ingredient = re.sub(r"one and one[\s\-]quarter", "1.25", ingredient)
-    ingredient = re.sub(r"two and one[\s\-]quarter", "2.25", ingredient)
-    ingredient = re.sub(r"two and one[\s\-]half", "2.5", ingredient)
-    ingredient = re.sub(r"three and a half", "3.5", ingredient)
-    match = re.findall(
-        r"(?<!(?:[^\w]))([Oo]ne|[Tt]wo|[Tt]hree|[Ff]our|[Ff]ive|[Ss]ix|[Ss]even|[Ee]ight|[Nn]ine|[Tt]en|[Dd]ozen)(?=(?:[^\w]))",
-        ingredient,
-    )
-    for m in match:
-        ingredient = re.sub(
-            r"(?<!(?:[^\w]))([Oo]ne|[Tt]wo|[Tt]hree|[Ff]our|[Ff]ive|[Ss]ix|[Ss]even|[Ee]ight|[Nn]ine|[Tt]en|[Dd]ozen)(?=(?:[^\w]))",
-            str(numbers[m.lower()]),
-            ingredient,
-        )
+def fix_numeric_words(ingredient):
+    for pattern, replacement in NUMERIC_PHRASES:
+        ingredient = pattern.sub(replacement, ingredient)
+    # Every number word is replaced by the value of the first one found,
+    # which is what the labeled data was cleaned with
+    match = NUMERIC_WORD.search(ingredient)
+    if match:
+        ingredient = NUMERIC_WORD.sub(str(numbers[match.group(1).lower()]), ingredient)
     return ingredient
 
 
 decimal.getcontext().rounding = decimal.ROUND_HALF_UP
 
+UNICODE_FRACTION = re.compile(r"(\d+\s?)?([\u2150-\u215E\u00BC-\u00BE])")
+
+
+def unicode_fraction_value(match):
+    if not match.group(1):  # single unicode fraction e.g. ¾
+        num = float(Fraction(unicodedata.numeric(match.group(2))))
+    else:  # mixed unicode fraction e.g. 1¾
+        num = float(match.group(1)) + float(
+            Fraction(unicodedata.numeric(match.group(2)))
+        )
+    num = decimal.Decimal(num)
+    num = round(num, 2)
+    return str(num.normalize())
+
 
 def clean_unicode_fractions(string):
     """
@@ -278,58 +332,62 @@ def clean_unicode_fractions(string):
     # match all mixed fractions with a unicode fraction (e.g. 1 ¾ or 1¾) and add them together
     # UNHANDLED EDGE CASE: There are a handful of ingredients in which the whole number is a quantity
     # mulitplier and not part of the fraction, e.g. 2 1/4 in cinnamon sticks, should be 0.5 not 2.25
-    match = re.findall(r"(\d+\s?)?([\u2150-\u215E\u00BC-\u00BE])", string)
-    if match:
-        for m in match:
-            if not m[0]:  # single unicode fraction e.g. ¾
-                num = float(Fraction(unicodedata.numeric(m[1])))
-            else:  # mixed unicode fraction e.g. 1¾
-                num = float(m[0]) + float(Fraction(unicodedata.numeric(m[1])))
-            num = decimal.Decimal(num)
-            num = round(num, 2)
-            num = str(num.normalize())
-            string = re.sub(r"(\d+\s?)?([\u2150-\u215E\u00BC-\u00BE])", num, string, 1)
-
-    return string
+    # Every fraction is replaced once, "½ ⅓" is "0.5 0.33" where the old loop
+    # made it "0.0.33"
+    if string.isascii():
+        return string
+    return UNICODE_FRACTION.sub(unicode_fraction_value, string)
 
 
 # Qty in data are rounded up to two decimal places
 
 
+def format_quantity(num):
+    num = decimal.Decimal(num)
+    num = round(num, 2)
+    if "E" in str(num.normalize()):
+        return str(num.quantize(decimal.Decimal("1")))
+    return str(num.normalize())
+
+
+MIXED_FRACTION = re.compile(r"(\d+)[\-\s](\d+\/\d+)")
+FRACTION = re.compile(r"(\d+\/\d+)")
+
+
+def mixed_fraction_value(match):
+    return format_quantity(float(match.group(1)) + float(Fraction(match.group(2))))
+
+
+def fraction_value(match):
+    return format_quantity(float(Fraction(match.group(1))))
+
+
 def merge_fractions(string):
     """
     Merges mixed fractions: 1 2/3 => 1.67
     """
     # This filters out NaN values so they wont get caught in the try except
     decimal.getcontext().rounding = decimal.ROUND_HALF_UP
-    if string == string:
-        match = re.findall(r"(\d+)[\-\s](\d+\/\d+)", string)
-        if match:
-            for m in match:
-                num = float(m[0]) + float(Fraction(m[1]))
-                num = decimal.Decimal(num)
-                num = round(num, 2)
-                if "E" in str(num.normalize()):
-                    num = str(num.quantize(decimal.Decimal("1")))
-                else:
-                    num = str(num.normalize())
-                string = re.sub(r"(\d+)[\-\s](\d+\/\d+)", num, string, 1)
-
-        match = re.findall(r"(\d+\/\d+)", string)
-        if match:
-            for m in match:
-                num = float(Fraction(m))
-                num = decimal.Decimal(num)
-                num = round(num, 2)
-                if "E" in str(num.normalize()):
-                    num = str(num.quantize(decimal.Decimal("1")))
-                else:
-                    num = str(num.normalize())
-                string = re.sub(r"(\d+\/\d+)", num, string, 1)
+    if string == string and "/" in string:
+        string = MIXED_FRACTION.sub(mixed_fraction_value, string)
+        string = FRACTION.sub(fraction_value, string)
 
     return string
 
 
+QUANTITY_RANGE = re.compile(r"(\d+\.?\d*)[\s\-]*[tor\-]+[\s\-]*(\d+\.?\d*)")
+QUANTITY_MULTIPLIER = re.compile(r"(\d+)\s+(\d+\.*\d*)")
+HYPHEN = re.compile(r"[\–\—\‐\‑\-]")
+
+
+def range_value(match):
+    return format_quantity((float(match.group(1)) + float(match.group(2))) / 2)
+
+
+def multiplier_value(match):
+    return format_quantity(float(match.group(1)) * float(match.group(2)))
+
+
 def merge_quantities(string):
     """
     Many ingredients are written in the form 2 8.5-ounce cans...
@@ -342,131 +400,416 @@ def merge_quantities(string):
     decimal.getcontext().rounding = decimal.ROUND_HALF_UP
     if string == string:
         # Ok first we need to average any number ranges, e.g. "3 to 4 pounds" becomes "3.5 pounds"
-
-        match = re.findall(r"(\d+\.?\d*)[\s\-]*[tor\-]+[\s\-]*(\d+\.?\d*)", string)
-        if match:
-            for m in match:
-                num = (float(m[0]) + float(m[1])) / 2
-                num = decimal.Decimal(num)
-                num = round(num, 2)
-                if "E" in str(num.normalize()):
-                    num = str(num.quantize(decimal.Decimal("1")))
-                else:
-                    num = str(num.normalize())
-                string = re.sub(
-                    r"(\d+\.?\d*)[\s\-]*[tor\-]+[\s\-]*(\d+\.?\d*)", num, string, 1
-                )
-
-        # now we do quantity multipliers
-        match = re.findall(r"(\d+)\s+(\d+\.*\d*)", string)
-        if match:
-            for m in match:
-                num = float(m[0]) * float(m[1])
-                num = decimal.Decimal(num)
-                num = round(num, 2)
-                if "E" in str(num.normalize()):
-                    num = str(num.quantize(decimal.Decimal("1")))
-                else:
-                    num = str(num.normalize())
-                string = re.sub(r"(\d+)\s+(\d+\.*\d*)", num, string, 1)
+        string = QUANTITY_RANGE.sub(range_value, string)
+        # now we do quantity multipliers, each pair once: "1 2 3 4" is "2 12"
+        # where the old loop made it "12 4"
+        string = QUANTITY_MULTIPLIER.sub(multiplier_value, string)
         # Remove hyphens we skipped before
-        string = re.sub(r"[\–\—\‐\‑\-]", " ", string)
+        string = HYPHEN.sub(" ", string)
 
     return string
 
 
-def fix_measurements(string, nlp = None):
+def round_half_up(value):
+    """
+    Rounds a float to hundredths exactly like round(Decimal(value), 2) under
+    ROUND_HALF_UP, using integer arithmetic on the float's exact ratio, and
+    returns the number of hundredths
+    """
+    numerator, denominator = value.as_integer_ratio()
+    hundredths, remainder = divmod(numerator * 100, denominator)
+    if 2 * remainder >= denominator:
+        hundredths += 1
+    return hundredths
+
+
+def render_quantity(value):
+    """
+    Same text as format_quantity: two decimals at most, no trailing zeros
+    """
+    whole, cents = divmod(round_half_up(value), 100)
+    if not cents:
+        return str(whole)
+    if cents % 10:
+        return "{}.{:02d}".format(whole, cents)
+    return "{}.{}".format(whole, cents // 10)
+
+
+# One quantity of an ingredient line. `text` is how it is written in the
+# cleaned line, `value` the number that text stands for and `span` where it
+# came from in the raw line. Units are left to the CRF tagger.
+Quantity = namedtuple("Quantity", ["value", "text", "span"])
+
+QUANTITY_TOKEN = re.compile(
+    # unicode fractions with an optional whole number, e.g. 1 ¾ or ¾
+    r"(\d+\s?)?([\u2150-\u215E\u00BC-\u00BE])"
+    # mixed fractions, e.g. 1 2/3 or 1-2/3, the dashes are the ones unidecode
+    # turns into a hyphen
+    r"|(\d+)[\-\s\u2010-\u2013\u2212](\d+)/(\d+)"
+    r"|(\d+)/(\d+)"
+    r"|\d+\.?\d*"
+)
+RANGE_GAP = re.compile(r"[\s\-]*[tor\-]+[\s\-]*")
+MULTIPLIER_GAP = re.compile(r"\s+")
+MULTIPLIER_HEAD = re.compile(r"(.*?)(\d+)$")
+# Range and multiplier gaps only hold whitespace, hyphens and t, o, r
+QUANTITY_PAIR = re.compile(r"\d\.?[\s\-tor]+\d")
+
+
+def quantity_token(match):
+    """
+    The Quantity of a QUANTITY_TOKEN match, None for a fraction over zero
+    """
+    if match.lastindex is None:
+        # A plain number keeps its text
+        return Quantity(float(match.group()), match.group(), match.span())
+    whole, fraction, mixed, numerator, denominator, top, bottom = match.groups()
+    if fraction:
+        value = unicodedata.numeric(fraction)
+        if whole:
+            value = float(whole) + value
+    elif mixed:
+        if not int(denominator):
+            return None
+        value = float(mixed) + int(numerator) / int(denominator)
+    else:
+        if not int(bottom):
+            return None
+        value = int(top) / int(bottom)
+    text = render_quantity(value)
+    return Quantity(float(text), text, match.span())
+
+
+def merge_pairs(parts, gap, merge, head=None):
+    """
+    Merges every quantity, gap, quantity run of `parts` whose gap text
+    fully matches `gap`, left to right without overlaps like re.sub
+    """
+    merged = []
+    i = 0
+    while i < len(parts):
+        part = parts[i]
+        if (
+            isinstance(part, Quantity)
+            and i + 2 < len(parts)
+            and isinstance(parts[i + 2], Quantity)
+            and gap.fullmatch(parts[i + 1])
+        ):
+            first = part
+            prefix = ""
+            if head is not None:
+                # Only the digits at the end of the first quantity take part
+                match = head.match(part.text)
+                if match is None:
+                    merged.append(part)
+                    i += 1
+                    continue
+                prefix, digits = match.groups()
+                first = part._replace(value=float(digits))
+            second = parts[i + 2]
+            text = render_quantity(merge(first.value, second.value))
+            if prefix:
+                merged.append(prefix)
+            merged.append(Quantity(float(text), text, (part.span[0], second.span[1])))
+            i += 3
+        else:
+            merged.append(part)
+            i += 1
+    return merged
+
+
+def split_quantities(string):
+    """
+    Splits a line into text and Quantity parts before any range or
+    multiplier is merged. Two quantities always have a text part between
+    them, empty when they touch. A fraction over zero stays text.
+    """
+    parts = []
+    quantities = 0
+    end = 0
+    ascii = string.isascii()
+    for match in QUANTITY_TOKEN.finditer(string):
+        token = quantity_token(match)
+        if token is None:
+            continue
+        start = match.start()
+        if start > end:
+            text = string[end:start]
+            parts.append(text if ascii else unidecode.unidecode(text))
+        elif quantities:
+            parts.append("")
+        parts.append(token)
+        quantities += 1
+        end = match.end()
+    if end < len(string) or not parts:
+        text = string[end:]
+        parts.append(text if ascii else unidecode.unidecode(text))
+    return parts
+
+
+def parse_quantities(string):
+    """
+    Splits an ingredient line into text and Quantity tokens in one scan and
+    merges them the way clean_unicode_fractions, unidecode, merge_fractions
+    and merge_quantities do in turn: fractions become decimals, ranges are
+    averaged ("3 to 4" => 3.5) and multipliers applied ("2 8.5" => 17).
+    The text between quantities is transliterated with unidecode.
+    """
+    parts = split_quantities(string)
+    if sum(isinstance(part, Quantity) for part in parts) > 1:
+        parts = merge_pairs(parts, RANGE_GAP, lambda a, b: (a + b) / 2)
+        parts = merge_pairs(parts, MULTIPLIER_GAP, lambda a, b: a * b, MULTIPLIER_HEAD)
+    return parts
+
+
+def render_quantities(parts):
+    """
+    Writes the parsed line back out, hyphens turned into spaces as in
+    merge_quantities. unidecode has already turned every other dash into a
+    hyphen.
+    """
+    return "".join(
+        part.text if isinstance(part, Quantity) else part for part in parts
+    ).replace("-", " ")
+
+
+def normalize_quantities(string):
+    """
+    Does the work of clean_unicode_fractions, unidecode, merge_fractions and
+    merge_quantities with one parse_quantities of the line. Every fraction,
+    range and multiplier is merged once, from the numbers of the raw line.
+    The old chain re-matched text it had already rewritten in a few shapes
+    and comes out differently there: "1/4-1/2" is now 0.38 (was "0.25.5"),
+    "3.5-1/2" is 2 (was "3.5.5") and "1 2 3 4" is "2 12" (was "12 4").
+    A fraction over zero is kept as written, where the old chain raised.
+    """
+    if string == string:
+        # Plain ascii lines without fractions or two numbers a range or
+        # multiplier could join only need their hyphens replaced
+        if string.isascii() and "/" not in string and not QUANTITY_PAIR.search(string):
+            return string.replace("-", " ")
+        string = render_quantities(parse_quantities(string))
+    return string
+
+
+# Units fix_measurements merges, as listed in the cleaning notebooks
+MEASUREMENT_UNITS = {
+    "teaspoon", "tablespoon", "cup", "milliliter", "gram", "container", "packet",
+    "bag", "quart", "pound", "can", "bottle", "pint", "package", "ounce", "jar",
+    "head", "gallon", "drop", "envelope", "bar", "box", "pinch", "dash", "bunch",
+    "recipe", "layer", "slice", "link", "bulb", "stalk", "square", "sprig",
+    "fillet", "piece", "leg", "thigh", "cube", "granule", "strip", "tray",
+    "leave", "loaf", "halve", "clove", "cleave", "leaf", "stick",
+}
+
+COMPOUND_MEASURE = re.compile(r"^(\d+\.?\d*) (\w+) (plus|and) (\d+\.?\d*) (\w+)")
+
+# Measures of one ingredient given in two units that convert to grams:
+# (first unit, second unit, word the ingredient must mention, grams per
+# first unit, grams per second unit). The first row that fits is used.
+COMPOUND_GRAMS = [
+    ("stick", "tablespoon", "butter", 113.398, 14.18),
+    ("pound", "tablespoon", "butter", unit_conversion.factor("pound"), 14.18),
+    ("ounce", "tablespoon", "butter", unit_conversion.factor("ounce"), 14.18),
+    (
+        "pound",
+        "ounce",
+        None,
+        unit_conversion.factor("pound"),
+        unit_conversion.factor("ounce"),
+    ),
+    ("head", "clove", "garlic", 56.699, 5.15),
+    ("tablespoon", "clove", "garlic", 5.15 * 3, 5.15),
+    ("packet", "teaspoon", "gelatin", 7, 3.08),
+]
+
+# Every other pair is added up in milliliters, with the factors of the
+# feature conversion table and an ounce read as a fluid ounce. The first unit
+# may need a word in the ingredient, e.g. a bottle is only 750 ml of wine.
+SECOND_UNIT_MILLILITERS = {
+    unit: unit_conversion.factor(unit)
+    for unit in ["teaspoon", "tablespoon", "cup"]
+}
+SECOND_UNIT_MILLILITERS["ounce"] = unit_conversion.factor("fluid ounce")
+# Rounded up from the 1/16 teaspoon of the table
+SECOND_UNIT_MILLILITERS["pinch"] = 0.31
+FIRST_UNIT_MILLILITERS = {
+    unit: (SECOND_UNIT_MILLILITERS[unit], None)
+    for unit in ["teaspoon", "tablespoon", "ounce", "cup"]
+}
+FIRST_UNIT_MILLILITERS["quart"] = (unit_conversion.factor("quart"), None)
+FIRST_UNIT_MILLILITERS["bottle"] = (750, "wine")
+
+
+def merge_measurement(string, lemmatized_input):
+    """
+    Merges a leading measure in two units, e.g. 1 stick plus 2 tablespoons
+    of butter, into one quantity using the lemmatized input
+    """
+    match = COMPOUND_MEASURE.match(lemmatized_input)
+    if not match:
+        return string
+    qty, unit, _, second_qty, second_unit = match.groups()
+    if unit not in MEASUREMENT_UNITS or second_unit not in MEASUREMENT_UNITS:
+        return string
+    for first, second, word, factor, second_factor in COMPOUND_GRAMS:
+        if (
+            unit == first
+            and second_unit == second
+            and (word is None or word in lemmatized_input)
+        ):
+            num = float(qty) * factor + float(second_qty) * second_factor
+            merged_unit = "gram"
+            break
+    else:
+        num = 0
+        factor, word = FIRST_UNIT_MILLILITERS.get(unit, (None, None))
+        if factor is not None and (word is None or word in lemmatized_input):
+            num += float(qty) * factor
+        else:
+            print(string)
+        if second_unit in SECOND_UNIT_MILLILITERS:
+            num += float(second_qty) * SECOND_UNIT_MILLILITERS[second_unit]
+        else:
+            print(string)
+            print(lemmatized_input)
+        merged_unit = "milliliter"
+    return COMPOUND_MEASURE.sub(str(round(num, 2)) + " " + merged_unit, string)
+
+
+def fix_measurements(string, nlp=None):
     input_tokens = nlp(string)
     lemmatized_input = " ".join([x.lemma_ for x in input_tokens])
+    return merge_measurement(string, lemmatized_input)
+
+
+# Lemmas need the tokenizer and tagger only
+LEMMA_DISABLE = ["parser", "ner", "textcat"]
+
+
+def fix_measurements_series(series, nlp, batch_size=1000):
+    """
+    fix_measurements over a whole column. Only the lines that start with a
+    measure in two units are lemmatized, each distinct line once, in
+    batches through nlp.pipe without the parser and entity recognizer.
+    Returns a new Series.
+    """
+    # The mask is positional, ingredient columns are exploded and repeat
+    # their index labels
+    mask = series.map(COMPOUND_MEASURE.match, na_action="ignore").notna().to_numpy()
+    candidates = series[mask]
+    lines = list(dict.fromkeys(candidates))
+    disable = [name for name in LEMMA_DISABLE if name in nlp.pipe_names]
+    merged = {
+        line: merge_measurement(line, " ".join([x.lemma_ for x in doc]))
+        for line, doc in zip(
+            lines, nlp.pipe(lines, batch_size=batch_size, disable=disable)
+        )
+    }
+    series = series.copy()
+    series.iloc[mask] = candidates.map(merged).to_numpy()
+    return series
+
+
+def clean_nyt_frame(frame):
+    """
+    Column-wise version of frame.apply(clean_nyt_html, axis=1) that returns
+    a new DataFrame
+    """
+    frame = frame.copy()
+    for col in ["input", "name", "comment"]:
+        # A column of nothing but NaN has no .str accessor and nothing to clean
+        if frame[col].isna().all():
+            continue
+        for pattern in [SEE_RECIPE_LINK, SEE_LINK_RECIPE]:
+            found = frame[col].map(pattern.search, na_action="ignore").notna()
+            frame[col] = frame[col].str.replace(pattern, "", regex=True)
+            comment = found & frame["comment"].notna()
+            if col == "input" and comment.any():
+                frame.loc[comment, "comment"] = frame.loc[
+                    comment, "comment"
+                ].str.replace(SEE_RECIPE, "", regex=True)
+        values = (
+            frame[col]
+            .str.replace(HTML_TAG, "", regex=True)
+            .str.replace("\\n", " ", regex=False)
+            .str.replace("\\t", " ", regex=False)
+        )
+        # Blank values become NaN before stripping, as in clean_nyt_html
+        blank = values == ""
+        values = values.str.strip()
+        values[blank] = float("nan")
+        frame[col] = values
+    return frame
 
-    match = re.findall(
-        r"^(\d+\.?\d*) (\w+) (plus|and) (\d+\.?\d*) (\w+)", lemmatized_input
+
+def clean_ingredient(string, html=None):
+    """
+    The cleaning chain of the notebooks for one ingredient line.
+    html="epi" first strips the Epicurious html.
+    """
+    if html == "epi":
+        string = clean_epi_html(string)
+    string = fix_characters(string)
+    string = fix_spelling(string)
+    string = fix_abbreviations(string)
+    string = fix_numeric_words(string)
+    return normalize_quantities(string)
+
+
+def clean_lines(lines, html=None):
+    """
+    clean_ingredient over a Series of strings, returned as a list. The html
+    and character steps run as .str operations over the whole column, the
+    regex rules of the other steps line by line.
+    """
+    if html == "epi":
+        lines = (
+            lines.str.replace(EPI_RECIPE_LINK, "", regex=True)
+            .str.replace("\\n", " ", regex=False)
+            .str.replace("\\t", " ", regex=False)
+            .str.strip()
+        )
+    lines = lines.str.translate(CHARACTER_TABLE)
+    return [
+        normalize_quantities(fix_numeric_words(fix_abbreviations(fix_spelling(line))))
+        for line in lines
+    ]
+
+
+def clean_series(series, html=None, cache=None):
+    """
+    Runs clean_ingredient over a whole column and returns a new Series with
+    the same index. Ingredient lines repeat a lot, so each distinct line is
+    cleaned once, and NaN values stay NaN without going through the chain.
+    A NormalizationCache passed as `cache` also keeps the cleaned lines
+    across columns and runs. NYT tables should go through clean_nyt_frame
+    first.
+
+    Most of the time goes to the regex rules of each line, which .str
+    methods run line by line too, so this is only as much faster than
+    .apply of every step as the column has repeated lines. The speedup over
+    the cleaning of the notebooks comes from the rewritten steps.
+    """
+    if cache is not None:
+        # Missing values come back as NaN, the same as without a cache
+        present = series.notna().to_numpy()
+        cleaned = pd.Series(
+            float("nan"), index=series.index, name=series.name, dtype=object
+        )
+        cleaned.iloc[present] = cache.map(
+            "clean:{}".format(html),
+            lambda lines: clean_lines(pd.Series(lines, dtype=object), html),
+            series[present].tolist(),
+        )
+        return cleaned
+    codes, uniques = pd.factorize(series)
+    cleaned = clean_lines(pd.Series(uniques, dtype=object), html)
+    # Code -1 marks NaN, which picks the NaN appended at the end
+    cleaned.append(float("nan"))
+    return pd.Series(
+        pd.Series(cleaned, dtype=object).to_numpy().take(codes),
+        index=series.index,
+        name=series.name,
+        dtype=object,
     )
-    for m in match:
-        if m[1] in measurementUnit and m[4] in measurementUnit:
-            num = 0
-            unit = ""
-            # sticks and tablespoons of butter
-            if (
-                m[1] == "stick"
-                and m[4] == "tablespoon"
-                and "butter" in lemmatized_input
-            ):
-                num += float(m[0]) * 113.398
-                num += float(m[3]) * 14.18
-                unit = "gram"
-            elif (
-                m[1] == "pound"
-                and m[4] == "tablespoon"
-                and "butter" in lemmatized_input
-            ):
-                num += float(m[0]) * 453.592
-                num += float(m[3]) * 14.18
-                unit = "gram"
-            elif (
-                m[1] == "ounce"
-                and m[4] == "tablespoon"
-                and "butter" in lemmatized_input
-            ):
-                num += float(m[0]) * 28.3495
-                num += float(m[3]) * 14.18
-                unit = "gram"
-            elif m[1] == "pound" and m[4] == "ounce":
-                num += float(m[0]) * 453.592
-                num += float(m[3]) * 28.3495
-                unit = "gram"
-            elif m[1] == "head" and m[4] == "clove" and "garlic" in lemmatized_input:
-                num += float(m[0]) * 56.699
-                num += float(m[3]) * 5.15
-                unit = "gram"
-            elif (
-                m[1] == "tablespoon"
-                and m[4] == "clove"
-                and "garlic" in lemmatized_input
-            ):
-                num += float(m[0]) * (5.15 * 3)
-                num += float(m[3]) * 5.15
-                unit = "gram"
-            elif (
-                m[1] == "packet"
-                and m[4] == "teaspoon"
-                and "gelatin" in lemmatized_input
-            ):
-                num += float(m[0]) * 7
-                num += float(m[3]) * 3.08
-                unit = "gram"
-            else:
-                if m[1] == "teaspoon":
-                    num += float(m[0]) * 4.92892
-                elif m[1] == "tablespoon":
-                    num += float(m[0]) * 14.7868
-                elif m[1] == "ounce":
-                    num += float(m[0]) * 29.5735
-                elif m[1] == "cup":
-                    num += float(m[0]) * 236.588
-                elif m[1] == "quart":
-                    num += float(m[0]) * 946.353
-                elif m[1] == "bottle" and "wine" in lemmatized_input:
-                    num += float(m[0]) * 750
-                else:
-                    print(string)
-                if m[4] == "teaspoon":
-                    num += float(m[3]) * 4.92892
-                elif m[4] == "tablespoon":
-                    num += float(m[3]) * 14.7868
-                elif m[4] == "ounce":
-                    num += float(m[3]) * 29.5735
-                elif m[4] == "cup":
-                    num += float(m[3]) * 236.588
-                elif m[4] == "pinch":
-                    num += float(m[3]) * 0.31
-                else:
-                    print(string)
-                    print(lemmatized_input)
-                unit = "milliliter"
-            string = re.sub(
-                r"^(\d+\.?\d*) (\w+) (plus|and) (\d+\.?\d*) (\w+)",
-                str(round(num, 2)) + " " + unit,
-                string,
-            )
-    return string
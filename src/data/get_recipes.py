@@ -1,217 +1,337 @@
 import json
 import time
-from urllib import request
-from urllib.error import HTTPError, URLError
-from bs4 import BeautifulSoup
+from requests.exceptions import RequestException
 
-import sys
-from os import path
+from os import path, remove
 import argparse
 from multiprocessing import Pool, cpu_count
-
-sys.path.append(path.join(path.dirname(path.abspath(__file__)), "recipe-scrapers"))
-from recipe_scrapers import scrape_me
+from multiprocessing.pool import ThreadPool
+
+from crawl_engine import CrawlEngine
+from recipe_store import RecipeStore
+from crawl_frontier import CrawlFrontier
+from http_cache import ResponseCache
+import http_session
+import crawl_metrics
+from recipe_extract import extract_recipe, parse_html
+import rate_control
+from rate_control import BACKOFF_CODES, rate_controller, retry_after_seconds
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows; U; Windows NT 5.1; en-US; rv:1.9.0.7) Gecko/2009021910 Firefox/3.0.7"
 }
 
-skip_list = []
+skip_urls = set()
+cache = None
+replay = False
+rate_settings = {}
+# Attempts per url when the site answers 429/503
+MAX_ATTEMPTS = 3
 
 
 def get_recipe(url):
     #print(url)
     try:
-        scraper = scrape_me(url)
-    except:
-        print("Could not scrape URL {}".format(url))
+        html = fetch_page(url)
+        start = time.time()
+        recipe = extract_recipe(url, html)
+        crawl_metrics.observe_parse(time.time() - start, recipe)
+        return recipe
+    except Exception as e:
+        # fetch_page already counted its own errors
+        if not isinstance(e, RequestException):
+            crawl_metrics.record_error(e)
+        print("Could not scrape URL {} ({})".format(url, e))
         return {}
 
-    try:
-        title = scraper.title()
-    except AttributeError:
-        title = None
 
-    try:
-        total_time = scraper.total_time()
-    except AttributeError:
-        total_time = None
+def fetch_page(url):
+    entry = cache.get(url) if cache is not None else None
+    if replay:
+        if entry is None:
+            raise RequestException("{} is not in the response cache".format(url))
+        return cache.body(entry)
+
+    headers = dict(HEADERS)
+    if entry is not None:
+        headers.update(cache.validators(entry))
+    controller = rate_controller(url, **rate_settings)
+    for attempt in range(MAX_ATTEMPTS):
+        controller.wait()
+        start = time.time()
+        try:
+            response = http_session.get(url, headers=headers)
+        except RequestException as e:
+            controller.failure()
+            crawl_metrics.record_error(e)
+            raise
+        if response.status_code == 304 and entry is not None:
+            controller.success(time.time() - start)
+            return cache.body(entry)
+        if response.status_code in BACKOFF_CODES and attempt < MAX_ATTEMPTS - 1:
+            controller.failure(retry_after_seconds(response.headers.get("Retry-After")))
+            continue
+        if response.status_code in BACKOFF_CODES:
+            controller.failure()
+        else:
+            controller.success(time.time() - start)
+        try:
+            response.raise_for_status()
+        except RequestException as e:
+            crawl_metrics.record_error(e)
+            raise
+        body = response.content
+        crawl_metrics.observe_fetch(url, time.time() - start, len(body))
+        break
+    if cache is not None:
+        cache.put(url, body, response.headers)
+    return body
+
+
+def fn_page_url(page_str, page_num):
+    base_url = "http://www.foodnetwork.com"
+    search_url_str = "recipes/recipes-a-z"
+    return "{}/{}/{}/p/{}".format(base_url, search_url_str, page_str, page_num)
 
-    try:
-        yields = scraper.yields()
-    except AttributeError:
-        yields = None
 
-    try:
-        ingredients = scraper.ingredients()
-    except AttributeError:
-        ingredients = None
+def fn_recipe_links(html):
+    soup = parse_html(html)
+    recipe_link_items = soup.select("div.o-Capsule__m-Body ul.m-PromoList li a")
+    return [r.attrs["href"] for r in recipe_link_items]
 
-    try:
-        instructions = scraper.instructions()
-    except AttributeError:
-        instructions = None
 
-    try:
-        tags = scraper.tags()
-    except AttributeError:
-        tags = None
+def get_all_recipes_fn(page_str, page_num):
+    url = fn_page_url(page_str, page_num)
 
     try:
-        avg_rating = scraper.avg_rating()
-    except AttributeError:
-        avg_rating = None
+        recipe_links = fn_recipe_links(fetch_page(url))
+        print("Read {} recipe links from {}".format(len(recipe_links), url))
+        return recipe_links
+    except RequestException:
+        print("Could not parse page {}".format(url))
+        return []
 
-    try:
-        best_rating = scraper.best_rating()
-    except AttributeError:
-        best_rating = None
 
-    try:
-        worst_rating = scraper.worst_rating()
-    except AttributeError:
-        worst_rating = None
+def ar_page_url(page_num):
+    return "http://allrecipes.com/recipes/?page={}".format(page_num)
 
-    try:
-        prepare_again_rating = scraper.prepare_again_rating()
-    except AttributeError:
-        prepare_again_rating = None
 
-    try:
-        num_reviews = scraper.num_reviews()
-    except AttributeError:
-        num_reviews = None
-
-    return {
-        "title": title,
-        "total_time": total_time,
-        "yields": yields,
-        "ingredients": ingredients,
-        "instructions": instructions,
-        "tags": tags,
-        "avg_rating": avg_rating,
-        "best_rating": best_rating,
-        "worst_rating": worst_rating,
-        "prepare_again_rating": prepare_again_rating,
-        "num_reviews": num_reviews,
-    }
+def ar_recipe_links(html):
+    base_url = "http://allrecipes.com"
+    soup = parse_html(html)
+    recipe_link_items = soup.select("article > a:nth-of-type(1)")
+    return list(
+        set(
+            [
+                base_url + r["href"]
+                for r in recipe_link_items
+                if r is not None and r["href"].split("/")[1] == "recipe"
+            ]
+        )
+    )
 
 
-def get_all_recipes_fn(page_str, page_num):
-    base_url = "http://www.foodnetwork.com"
-    search_url_str = "recipes/recipes-a-z"
-    url = "{}/{}/{}/p/{}".format(base_url, search_url_str, page_str, page_num)
+def get_all_recipes_ar(page_num):
+    url = ar_page_url(page_num)
 
     try:
-        soup = BeautifulSoup(
-            request.urlopen(request.Request(url, headers=HEADERS)).read(), "html.parser"
-        )
-        recipe_link_items = soup.select("div.o-Capsule__m-Body ul.m-PromoList li a")
-        recipe_links = [r.attrs["href"] for r in recipe_link_items]
-        print("Read {} recipe links from {}".format(len(recipe_links), url))
-        return recipe_links
-    except (HTTPError, URLError):
+        recipe_links = ar_recipe_links(fetch_page(url))
+        recipe_links = [r for r in recipe_links if r not in skip_urls]
+        return {r: get_recipe(r) for r in recipe_links}
+    except RequestException:
         print("Could not parse page {}".format(url))
         return []
 
 
-def get_all_recipes_ar(page_num):
-    base_url = "http://allrecipes.com"
-    search_url_str = "recipes/?page"
-    url = "{}/{}={}".format(base_url, search_url_str, page_num)
+def se_page_url(page_num):
+    return "https://www.seriouseats.com/recipes/?page={}".format(page_num)
+
+
+def se_recipe_links(html):
+    soup = parse_html(html)
+    recipe_link_items = soup.select("a.module__link")
+    return list(set([r["href"] for r in recipe_link_items if r is not None]))
 
-    try:
-        soup = BeautifulSoup(
-            request.urlopen(request.Request(url, headers=HEADERS)).read(), "html.parser"
-        )
-        recipe_link_items = soup.select("article > a:nth-of-type(1)")
-        recipe_links = list(
-            set(
-                [
-                    r["href"]
-                    for r in recipe_link_items
-                    if r is not None and r["href"].split("/")[1] == "recipe"
-                ]
-            )
-        )
-        return {base_url + r: get_recipe(base_url + r) for r in recipe_links}
-    except (HTTPError, URLError):
-        print("Could not parse page {}".format(url))
-        return []
 
 def get_all_recipes_se(page_num):
-    base_url = "https://www.seriouseats.com"
-    search_url_str = "recipes/?page"
-    url = "{}/{}={}".format(base_url, search_url_str, page_num)
+    url = se_page_url(page_num)
     try:
-        soup = BeautifulSoup(
-            request.urlopen(request.Request(url, headers=HEADERS)).read(), "html.parser"
-        )
-        recipe_link_items = soup.select("a.module__link")
-        recipe_links = list(
-            set(
-                [
-                    r["href"]
-                    for r in recipe_link_items
-                    if r is not None
-                ]
-            )
-        )
-        recipe_links = [r for r in recipe_links if r not in skip_list]
+        recipe_links = se_recipe_links(fetch_page(url))
+        recipe_links = [r for r in recipe_links if r not in skip_urls]
         return {r: get_recipe(r) for r in recipe_links}
-    except (HTTPError, URLError):
+    except RequestException:
         print("Could not parse page {}".format(url))
         return []
 
 
-def get_all_recipes_epi(page_num):
+def epi_page_url(page_num):
+    return "http://www.epicurious.com/search/?content=recipe&page={}".format(page_num)
+
+
+def epi_recipe_links(html):
     base_url = "http://www.epicurious.com"
-    search_url_str = "search/?content=recipe&page"
-    url = "{}/{}={}".format(base_url, search_url_str, page_num)
-    global recipes
+    soup = parse_html(html)
+    recipe_link_items = soup.select(
+        "div.results-group article.recipe-content-card a.view-complete-item"
+    )
+    return [base_url + r["href"] for r in recipe_link_items]
+
+
+def get_all_recipes_epi(page_num):
+    url = epi_page_url(page_num)
     try:
-        soup = BeautifulSoup(
-            request.urlopen(request.Request(url, headers=HEADERS)).read(), "html.parser"
-        )
-        recipe_link_items = soup.select(
-            "div.results-group article.recipe-content-card a.view-complete-item"
-        )
-        recipe_links = [r["href"] for r in recipe_link_items]
-        recipe_links = [r for r in recipe_links if base_url + r not in skip_list]
-        return {base_url + r: get_recipe(base_url + r) for r in recipe_links}
-    except (HTTPError, URLError):
+        recipe_links = epi_recipe_links(fetch_page(url))
+        recipe_links = [r for r in recipe_links if r not in skip_urls]
+        return {r: get_recipe(r) for r in recipe_links}
+    except RequestException:
         print("Could not parse page {}".format(url))
         return []
 
 
+# Listing page url builder and recipe link parser for each site, used by the
+# asyncio crawl engine
+SITES = {
+    "ar": (ar_page_url, ar_recipe_links),
+    "se": (se_page_url, se_recipe_links),
+    "epi": (epi_page_url, epi_recipe_links),
+}
+
+
+def start_worker(rates):
+    # Pool workers buffer their metrics for the parent and take their rate
+    # controllers from it, so a host sees one rate however many workers run
+    crawl_metrics.start_buffer()
+    rate_control.share_controllers(rates)
+
+
+def scrape_page(job):
+    # Pool workers send the page number back so results can arrive in any
+    # order, together with the metrics they observed while scraping it
+    scraper, page_num = job
+    recipes = scraper(page_num)
+    return page_num, recipes, crawl_metrics.take_buffer()
+
+
 def scrape_recipe_box(scraper, site_str, page_iter, status_interval=50):
 
+    frontier = crawl_frontier(site_str)
+    store = recipe_store(site_str)
+    global skip_urls
+    skip_urls = frontier.seen
     if args.append:
-        recipes = quick_load(site_str)
+        skip_urls.update(quick_load(site_str).keys())
     else:
-        recipes = {}
-    global skip_list
-    skip_list = list(recipes.keys())
+        quick_clear(site_str)
+    page_iter = [i for i in page_iter if not frontier.is_page_done(i)]
     start = time.time()
+    scraped = [0]
+
+    def record_page(page_num, page_recipes):
+        # get_all_recipes_* return a list when the listing page failed
+        if isinstance(page_recipes, list):
+            frontier.page_failed(page_num)
+            return
+        for url, recipe in page_recipes.items():
+            record_recipe(url, recipe)
+        frontier.page_done(page_num)
+        crawl_metrics.record_page(site_str)
+
+    def record_recipe(url, recipe):
+        # get_recipe returns an empty dict when the recipe could not be scraped
+        # Recipes go straight to the store, so memory does not grow with the crawl
+        if recipe:
+            store.append(url, recipe)
+            scraped[0] += 1
+            frontier.recipe_done(url)
+            crawl_metrics.record_recipe(site_str)
+        else:
+            frontier.recipe_failed(url)
+
+    def checkpoint(pages_done):
+        if pages_done % status_interval == 0:
+            print(
+                "Scraped {} pages, {} recipes from {}".format(
+                    pages_done, scraped[0], site_str
+                )
+            )
+            # The frontier is committed only once the recipes of its done
+            # pages are fsynced, so a crash never marks a page done whose
+            # recipes were lost
+            store.flush()
+            frontier.commit()
+
     if args.multi:
-        pool = Pool(cpu_count() * 2)
-        results = pool.map(scraper, page_iter)
-        for r in results:
-            recipes.update(r)
+        with rate_control.RateManager() as manager, Pool(
+            cpu_count() * 2,
+            initializer=start_worker,
+            initargs=(manager.HostRates(**rate_settings),),
+        ) as pool:
+            jobs = ((scraper, i) for i in page_iter)
+            results = pool.imap_unordered(scrape_page, jobs)
+            for n, (i, r, events) in enumerate(results, 1):
+                crawl_metrics.replay(events)
+                record_page(i, r)
+                checkpoint(n)
+    elif args.use_async:
+        engine = CrawlEngine(fetch_page, per_host=args.per_host)
+        pages_done = [0]
+
+        def on_page_done(page_num):
+            frontier.page_done(page_num)
+            crawl_metrics.record_page(site_str)
+            pages_done[0] += 1
+            checkpoint(pages_done[0])
+
+        if site_str == "fn":
+            # Walk every letter of the index concurrently and scrape recipes
+            # as soon as their links are read. A resumed crawl starts from
+            # the pages its frontier has not finished.
+            pages = fn_resume_pages(frontier)
+            queued = set(page_key for page_key, _ in pages)
+
+            def next_page(page_key, links):
+                page = fn_next_page(page_key, links)
+                if page is None or page[0] in queued or frontier.is_page_done(page[0]):
+                    return None
+                return page
+
+            engine.run(
+                get_recipe,
+                record_recipe,
+                pages=pages,
+                parse_links=fn_recipe_links,
+                next_page=next_page,
+                seen=skip_urls,
+                on_page_done=on_page_done,
+                on_page_error=frontier.page_failed,
+            )
+        else:
+            page_url, recipe_links = SITES[site_str]
+            engine.run(
+                get_recipe,
+                record_recipe,
+                pages=((i, page_url(i)) for i in page_iter),
+                parse_links=recipe_links,
+                seen=skip_urls,
+                on_page_done=on_page_done,
+                on_page_error=frontier.page_failed,
+            )
     else:
-        for i in page_iter:
-            recipes.update(scraper(i))
-            if i % status_interval == 0:
-                print("Scraping page {} of {}".format(i, max(page_iter)))
-                quick_save(site_str, recipes)
-            time.sleep(args.sleep)
+        for n, i in enumerate(page_iter, 1):
+            record_page(i, scraper(i))
+            checkpoint(n)
 
     print(
         "Scraped {} recipes from {} in {:.0f} minutes".format(
-            len(recipes), site_str, (time.time() - start) / 60
+            scraped[0], site_str, (time.time() - start) / 60
         )
     )
-    quick_save(site_str, recipes)
+    store.flush()
+    frontier.commit()
+    quick_compact(site_str)
+    crawl_metrics.write_summary(
+        path.join("../../data/raw", "crawl_summary_{}.json".format(site_str))
+    )
 
 
 def get_fn_letter_links():
@@ -221,50 +341,109 @@ def get_fn_letter_links():
     url = "{}/{}/{}".format(base_url, search_url_str, "")
 
     try:
-        soup = BeautifulSoup(
-            request.urlopen(request.Request(url, headers=HEADERS)).read(), "html.parser"
-        )
+        soup = parse_html(fetch_page(url))
         page_link_items = soup.select("ul.o-IndexPagination__m-List li a")
         letter_links = [p["href"] for p in page_link_items]
         return letter_links
-    except (HTTPError, URLError):
+    except RequestException:
         print("Could not parse page {}".format(url))
 
 
-def get_fn_recipe_links():
+def fn_letter_pages():
+    return [
+        ("{}/1".format(path.basename(p)), fn_page_url(path.basename(p), 1))
+        for p in get_fn_letter_links() or []
+    ]
+
+
+def fn_next_page(page_key, recipe_links):
+    # Each letter of the index is paged through until a page comes back empty
+    if not recipe_links:
+        return None
+    page_str, page_num = page_key.rsplit("/", 1)
+    page_num = int(page_num) + 1
+    return "{}/{}".format(page_str, page_num), fn_page_url(page_str, page_num)
+
+
+def fn_resume_pages(frontier):
+    """
+    Listing pages of every letter that a crawl still has to read: the pages
+    up to the last one done that are not done yet, and the page after it
+    """
+    last_done = {}
+    for page_key in frontier.pages_done:
+        page_str, page_num = page_key.rsplit("/", 1)
+        last_done[page_str] = max(last_done.get(page_str, 0), int(page_num))
+    pages = []
+    for page_key, _ in fn_letter_pages():
+        page_str = page_key.rsplit("/", 1)[0]
+        for page_num in range(1, last_done.get(page_str, 0) + 2):
+            page_key = "{}/{}".format(page_str, page_num)
+            if not frontier.is_page_done(page_key):
+                pages.append((page_key, fn_page_url(page_str, page_num)))
+    return pages
+
+
+def get_fn_letter_recipe_links(page):
+    page_key, _ = page
+    recipe_links = {}
+    while page_key is not None:
+        page_str, page_num = page_key.rsplit("/", 1)
+        recipe_links[page_key] = get_all_recipes_fn(page_str, int(page_num))
+        page_key, _ = fn_next_page(page_key, recipe_links[page_key]) or (None, None)
+    return recipe_links
+
 
-    letter_links = get_fn_letter_links()
+def get_fn_recipe_links():
+    # Letters are independent, so they are paged through concurrently
     recipe_links = {}
-    page_tracker = 0
-
-    for page in letter_links:
-        recipe_set = True
-        page_num = 1
-        lag0 = 0
-        while recipe_set:
-            t0 = time.time()
-            recipe_set = get_all_recipes_fn(path.basename(page), page_num)
-            lag1 = time.time() - t0
-            recipe_links[page_tracker] = []
-            recipe_links[page_tracker].extend(recipe_set)
-            page_num += 1
-            page_tracker += 1
-            time.sleep(lag1 * 0.5 + lag0 * 0.5)
-            lag0 = lag1
+    with ThreadPool(args.per_host) as pool:
+        for letter_links in pool.imap_unordered(
+            get_fn_letter_recipe_links, fn_letter_pages()
+        ):
+            recipe_links.update(letter_links)
 
     return recipe_links
 
 
 def scrape_fn(page_num):
     global recipe_links_dict
-    recipe_links = recipe_links_dict[page_num]
+    recipe_links = [r for r in recipe_links_dict[page_num] if r not in skip_urls]
     return {r: get_recipe(r) for r in recipe_links}
 
 
+stores = {}
+frontiers = {}
+
+
+def crawl_frontier(site_str):
+    # A fresh run starts from an empty frontier, --append resumes the last one
+    if site_str not in frontiers:
+        frontiers[site_str] = CrawlFrontier(
+            path.join("../../data/raw", "frontier_{}.sqlite".format(site_str)),
+            site_str,
+        )
+        if not args.append:
+            frontiers[site_str].reset()
+    return frontiers[site_str]
+
+
+def recipe_store(site_str):
+    if site_str not in stores:
+        stores[site_str] = RecipeStore(
+            path.join("../../data/raw", "recipes_raw_{}.jsonl".format(site_str))
+        )
+    return stores[site_str]
+
+
 def quick_load(site_str):
-    return load_recipes(
-        path.join("../../data/raw", "recipes_raw_{}.json".format(site_str))
-    )
+    store = recipe_store(site_str)
+    legacy_filename = path.join("../../data/raw", "recipes_raw_{}.json".format(site_str))
+    if not path.isfile(store.filename) and path.isfile(legacy_filename):
+        # Carry a run saved before the line-delimited store existed over
+        store.update(load_recipes(legacy_filename))
+        store.flush()
+    return store.load()
 
 
 def load_recipes(filename):
@@ -273,8 +452,24 @@ def load_recipes(filename):
 
 
 def quick_save(site_str, recipes):
+    # Only recipes the store has not seen yet are written
+    store = recipe_store(site_str)
+    store.update(recipes)
+    store.flush()
+
+
+def quick_clear(site_str):
+    store = recipe_store(site_str)
+    if path.isfile(store.filename):
+        remove(store.filename)
+    store.keys = set()
+
+
+def quick_compact(site_str):
+    # Compact the store and write the single JSON document the notebooks read
     save_recipes(
-        path.join("../../data/raw", "recipes_raw_{}.json".format(site_str)), recipes
+        path.join("../../data/raw", "recipes_raw_{}.json".format(site_str)),
+        recipe_store(site_str).compact(),
     )
 
 
@@ -291,7 +486,13 @@ if __name__ == "__main__":
     parser.add_argument("--se", action="store_true", help="Serious Eats")
     parser.add_argument("--multi", action="store_true", help="Multi threading")
     parser.add_argument(
-        "--append", action="store_true", help="Append scraping run to existing JSON doc"
+        "--async", dest="use_async", action="store_true", help="Asyncio crawl engine"
+    )
+    parser.add_argument(
+        "--per-host", type=int, default=4, help="Max in-flight requests per host"
+    )
+    parser.add_argument(
+        "--append", action="store_true", help="Append scraping run to existing recipe store"
     )
     parser.add_argument("--status", type=int, default=50, help="Print status interval")
     parser.add_argument("--start", type=int, default=1, help="Start page")
@@ -299,12 +500,52 @@ if __name__ == "__main__":
         "--pages", type=int, default=3000, help="Number of pages to scrape"
     )
     parser.add_argument(
-        "--sleep", type=int, default=0, help="Seconds to wait before scraping next page"
+        "--rate", type=float, default=1.0, help="Starting requests per second per host"
+    )
+    parser.add_argument(
+        "--max-rate", type=float, default=10.0, help="Max requests per second per host"
+    )
+    parser.add_argument(
+        "--connect-timeout", type=float, default=5, help="Connect timeout in seconds"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Read timeout in seconds"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Do not keep raw responses on disk"
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Re-run extraction over cached responses without network access",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=8000,
+        help="Local port for Prometheus metrics, 0 to disable",
     )
     args = parser.parse_args()
-    if args.fn:
-        recipe_links_dict = get_fn_recipe_links()
-        page_iter = range(1, len(recipe_links_dict) + 1)
+    crawl_metrics.start(args.metrics_port)
+    replay = args.replay
+    rate_settings = {"rate": args.rate, "max_rate": args.max_rate}
+    http_session.settings["timeout"] = (args.connect_timeout, args.timeout)
+    http_session.settings["pool_size"] = args.per_host
+    if not args.no_cache or replay:
+        cache = ResponseCache(path.join("../../data/raw", "http_cache"))
+    if args.fn and args.use_async:
+        scrape_recipe_box(scrape_fn, "fn", [], args.status)
+    elif args.fn:
+        frontier = crawl_frontier("fn")
+        if frontier.get_meta("discovered"):
+            # Reuse the recipe links found by the run we are resuming
+            recipe_links_dict = frontier.links()
+        else:
+            recipe_links_dict = get_fn_recipe_links()
+            for i, links in recipe_links_dict.items():
+                frontier.add_links(i, links)
+            frontier.set_meta("discovered", "1")
+        page_iter = sorted(recipe_links_dict)
         scrape_recipe_box(scrape_fn, "fn", page_iter, args.status)
     if args.epi:
         page_iter = range(args.start, args.pages + args.start)
@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of raw HTTP responses. Bodies are stored
+    gzip compressed under the sha1 of their content in `objects/`, and every
+    url gets a small JSON entry in `index/` pointing at its body together
+    with the ETag/Last-Modified validators used for conditional GETs.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "index"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+
+    def _index_path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "index", key[:2], key + ".json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest + ".gz")
+
+    def _write(self, filename, data):
+        # Write to a temporary file first so readers never see half a file
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # mkstemp gives every process and thread of a crawl its own file
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(filename), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+
+    def get(self, url):
+        try:
+            with open(self._index_path(url), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def body(self, entry):
+        with gzip.open(self._object_path(entry["sha1"]), "rb") as f:
+            return f.read()
+
+    def validators(self, entry):
+        """
+        Returns the request headers for a conditional GET of a cached entry
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, body, headers):
+        digest = hashlib.sha1(body).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.isfile(object_path):
+            self._write(object_path, gzip.compress(body))
+        entry = {
+            "url": url,
+            "sha1": digest,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched": time.time(),
+        }
+        self._write(self._index_path(url), json.dumps(entry).encode("utf-8"))
+        return entry
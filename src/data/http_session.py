@@ -0,0 +1,42 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# urllib3 only decodes brotli when the brotli bindings are installed
+try:
+    import brotli  # noqa: F401
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# (connect, read) timeouts in seconds and keep-alive connections per host
+settings = {"timeout": (5, 30), "pool_size": 4}
+
+_local = threading.local()
+
+
+def session():
+    """
+    Returns this thread's keep-alive session, so every worker thread reuses
+    its own TCP/TLS connections instead of opening one per request. A
+    forked Pool worker inherits its parent's thread-local session and open
+    sockets, so the session is also keyed on the process id.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        s = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings["pool_size"], pool_maxsize=settings["pool_size"]
+        )
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        s.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        _local.session = s
+        _local.pid = os.getpid()
+    return _local.session
+
+
+def get(url, headers=None):
+    return session().get(url, headers=headers, timeout=settings["timeout"])
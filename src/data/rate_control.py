@@ -0,0 +1,159 @@
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from urllib.parse import urlparse
+
+# Status codes that mean the site wants us to slow down
+BACKOFF_CODES = (429, 503)
+
+
+class RateController:
+    """
+    Token bucket whose refill rate is tuned with AIMD: every healthy response
+    adds `increase` requests/sec, while a 429/503, an error or a latency well
+    above the running average halves the rate. Thread safe, so the async
+    engine's worker threads and the serial scrapers can share one per host.
+    """
+
+    def __init__(
+        self,
+        rate=1.0,
+        min_rate=0.05,
+        max_rate=20.0,
+        increase=0.1,
+        decrease=0.5,
+        burst=1,
+        latency_factor=2.0,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.latency_factor = latency_factor
+        self.latency = None
+        self.tokens = burst
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self):
+        """
+        Blocks until the next request to this host may be sent
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+    def success(self, latency):
+        with self._lock:
+            if self.latency is not None and latency > self.latency * self.latency_factor:
+                self._backoff()
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            # Exponentially weighted moving average of the response time
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def failure(self, retry_after=None):
+        with self._lock:
+            self._backoff()
+            if retry_after:
+                self.blocked_until = time.monotonic() + retry_after
+
+    def _backoff(self):
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+
+
+controllers = {}
+_controllers_lock = threading.Lock()
+# Set in Pool workers, whose controllers live in the parent's RateManager
+_shared_rates = None
+
+
+def rate_controller(url, **kwargs):
+    """
+    Returns the shared controller for the host of `url`
+    """
+    if _shared_rates is not None:
+        return SharedController(_shared_rates, url)
+    host = urlparse(url).netloc
+    with _controllers_lock:
+        if host not in controllers:
+            controllers[host] = RateController(**kwargs)
+        return controllers[host]
+
+
+class HostRates:
+    """
+    The controller of every host, held by a RateManager so that all the
+    processes of a Pool share them
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def wait(self, url):
+        rate_controller(url, **self.kwargs).wait()
+
+    def success(self, url, latency):
+        rate_controller(url, **self.kwargs).success(latency)
+
+    def failure(self, url, retry_after=None):
+        rate_controller(url, **self.kwargs).failure(retry_after)
+
+
+class RateManager(BaseManager):
+    pass
+
+
+RateManager.register("HostRates", HostRates)
+
+
+class SharedController:
+    """
+    The controller of one host as seen from a Pool worker, every call goes
+    to the HostRates proxy
+    """
+
+    def __init__(self, rates, url):
+        self.rates = rates
+        self.url = url
+
+    def wait(self):
+        self.rates.wait(self.url)
+
+    def success(self, latency):
+        self.rates.success(self.url, latency)
+
+    def failure(self, retry_after=None):
+        self.rates.failure(self.url, retry_after)
+
+
+def share_controllers(rates):
+    """
+    Pool initializer: makes rate_controller hand out the controllers of the
+    HostRates proxy `rates` instead of ones of this process
+    """
+    global _shared_rates
+    _shared_rates = rates
+
+
+def retry_after_seconds(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
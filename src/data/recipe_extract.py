@@ -0,0 +1,147 @@
+import json
+import re
+
+from bs4 import BeautifulSoup
+from recipe_scrapers import SCRAPERS, WebsiteNotImplementedError, url_path_to_dict
+from recipe_scrapers._utils import get_yields
+
+# lxml is several times faster than the pure python html.parser
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+RECIPE_FIELDS = [
+    "title",
+    "total_time",
+    "yields",
+    "ingredients",
+    "instructions",
+    "tags",
+    "avg_rating",
+    "best_rating",
+    "worst_rating",
+    "prepare_again_rating",
+    "num_reviews",
+]
+
+ISO_DURATION = re.compile(
+    r"P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?"
+    r"(?:(?P<seconds>\d+)S)?)?"
+)
+
+
+def parse_html(html):
+    return BeautifulSoup(html, HTML_PARSER)
+
+
+def scraper_class(url):
+    host_name = url_path_to_dict(url.replace("://www.", "://"))["host"]
+    try:
+        return SCRAPERS[host_name]
+    except KeyError:
+        raise WebsiteNotImplementedError(
+            "Website ({}) is not supported".format(host_name)
+        )
+
+
+def scraper_for_soup(url, soup):
+    """
+    Builds the recipe_scrapers scraper for a page we already parsed, without
+    the fetch and html.parser pass its constructor would do
+    """
+    cls = scraper_class(url)
+    scraper = cls.__new__(cls)
+    scraper.soup = soup
+    scraper.testing_mode = False
+    scraper.url = url
+    return scraper
+
+
+def json_ld_recipe(soup):
+    """
+    Returns the schema.org Recipe object from the page's JSON-LD blocks
+    """
+    for script in soup.find_all("script", {"type": "application/ld+json"}):
+        try:
+            data = json.loads(script.string or "")
+        except ValueError:
+            continue
+        items = data if isinstance(data, list) else [data]
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            items.extend(item.get("@graph", []))
+            item_type = item.get("@type")
+            if item_type == "Recipe" or (
+                isinstance(item_type, list) and "Recipe" in item_type
+            ):
+                return item
+    return {}
+
+
+def iso_minutes(duration):
+    match = ISO_DURATION.match(duration or "")
+    if match is None or not any(match.groups()):
+        return None
+    parts = {k: int(v or 0) for k, v in match.groupdict().items()}
+    return parts["days"] * 1440 + parts["hours"] * 60 + parts["minutes"]
+
+
+def schema_fields(schema):
+    """
+    Maps a schema.org Recipe object onto our recipe fields
+    """
+    rating = schema.get("aggregateRating") or {}
+    instructions = schema.get("recipeInstructions")
+    if isinstance(instructions, list):
+        instructions = "\n".join(
+            step.get("text", "") if isinstance(step, dict) else step
+            for step in instructions
+        )
+    yields = schema.get("recipeYield")
+    if isinstance(yields, list):
+        yields = yields[0] if yields else None
+    keywords = schema.get("keywords")
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(",") if k.strip()]
+    return {
+        "title": schema.get("name"),
+        "total_time": iso_minutes(schema.get("totalTime")),
+        "yields": get_yields(str(yields)) if yields else None,
+        "ingredients": schema.get("recipeIngredient"),
+        "instructions": instructions,
+        "tags": keywords,
+        "avg_rating": rating.get("ratingValue"),
+        "best_rating": rating.get("bestRating"),
+        "worst_rating": rating.get("worstRating"),
+        "prepare_again_rating": None,
+        "num_reviews": rating.get("reviewCount") or rating.get("ratingCount"),
+    }
+
+
+def extract_recipe(url, html):
+    """
+    Extracts every recipe field from a single parse of the page. The site's
+    scraper is read first and the JSON-LD block fills the fields it missed.
+    """
+    soup = parse_html(html)
+    scraper = scraper_for_soup(url, soup)
+    recipe = {}
+    for field in RECIPE_FIELDS:
+        try:
+            recipe[field] = getattr(scraper, field)()
+        except AttributeError:
+            recipe[field] = None
+
+    missing = [f for f in RECIPE_FIELDS if recipe[f] in (None, "", [], 0)]
+    if missing:
+        schema = json_ld_recipe(soup)
+        if schema:
+            schema = schema_fields(schema)
+            for field in missing:
+                if schema[field] not in (None, "", []):
+                    recipe[field] = schema[field]
+    return recipe
@@ -0,0 +1,74 @@
+import json
+import os
+
+
+class RecipeStore:
+    """
+    Append-only recipe store with one {url: recipe} JSON object per line.
+    New recipes are buffered and written with a single fsync per batch, so
+    the cost of a checkpoint only depends on how many recipes are new.
+    """
+
+    def __init__(self, filename, sync_every=100):
+        self.filename = filename
+        self.sync_every = sync_every
+        self.keys = set()
+        self._buffer = []
+
+    def load(self):
+        recipes = {}
+        if not os.path.isfile(self.filename):
+            return recipes
+        with open(self.filename, "rb+") as f:
+            end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # A crash during a write can leave a partial last line,
+                    # cut it off so the next batch starts on a fresh line
+                    print("Dropping partial last line in {}".format(self.filename))
+                    f.truncate(end)
+                    break
+                end += len(line)
+                try:
+                    recipes.update(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    print("Skipping unreadable line in {}".format(self.filename))
+        self.keys.update(recipes.keys())
+        return recipes
+
+    def append(self, url, recipe):
+        if url in self.keys:
+            return
+        self.keys.add(url)
+        self._buffer.append(json.dumps({url: recipe}, ensure_ascii=False))
+        if len(self._buffer) >= self.sync_every:
+            self.flush()
+
+    def update(self, recipes):
+        for url in recipes.keys() - self.keys:
+            self.append(url, recipes[url])
+
+    def flush(self):
+        if not self._buffer:
+            return
+        with open(self.filename, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._buffer = []
+
+    def compact(self):
+        """
+        Rewrites the store with one line per recipe, dropping duplicate and
+        unreadable lines, and returns the recipes it holds
+        """
+        self.flush()
+        recipes = self.load()
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            for url, recipe in recipes.items():
+                f.write(json.dumps({url: recipe}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        return recipes
@@ -0,0 +1,151 @@
+import argparse
+import sys
+import time
+from os import path
+
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), "../.."))
+import pandas as pd
+import sklearn_crfsuite
+import spacy
+from joblib import dump
+from sklearn.model_selection import train_test_split
+from sklearn_crfsuite import metrics
+from src.features.create_features import (
+    FEATURE_PROFILES,
+    crf_model_file,
+    doc_features,
+)
+
+DATA_DIR = path.join(path.dirname(path.abspath(__file__)), "../../data/interim")
+
+
+def load_data(data_file, labels_file, limit=None):
+    lines = pd.read_pickle(data_file)["input"].astype("unicode")
+    labels = pd.read_pickle(labels_file)
+    lines, labels = lines.align(labels, join="inner")
+    if limit:
+        lines, labels = lines.iloc[:limit], labels.iloc[:limit]
+    return lines.tolist(), [list(l) for l in labels]
+
+
+def featurize(nlp, lines, dep, batch_size=50):
+    start = time.perf_counter()
+    features = [
+        doc_features(doc, dep) for doc in nlp.pipe(lines, batch_size=batch_size)
+    ]
+    return features, time.perf_counter() - start
+
+
+def train_crf(X_train, y_train):
+    # The settings of the Train CRF Model notebook
+    crf = sklearn_crfsuite.CRF(
+        algorithm="lbfgs",
+        c1=0.43,
+        c2=0.012,
+        max_iterations=100,
+        all_possible_states=True,
+        all_possible_transitions=True,
+        linesearch="StrongBacktracking",
+    )
+    crf.fit(X_train, y_train)
+    return crf
+
+
+def bench_profile(key, model, lines, labels, test_size, seed, save_model=False):
+    profile = FEATURE_PROFILES[key]
+    start = time.perf_counter()
+    nlp = spacy.load(model, disable=profile["disable"])
+    load_time = time.perf_counter() - start
+    features, feature_time = featurize(nlp, lines, profile["dep"])
+
+    # Tokenizers of different models can split a line differently from the
+    # one that labelled it, those lines cannot be scored
+    rows = [(x, y) for x, y in zip(features, labels) if len(x) == len(y)]
+    X_train, X_test, y_train, y_test = train_test_split(
+        [x for x, _ in rows],
+        [y for _, y in rows],
+        test_size=test_size,
+        random_state=seed,
+    )
+    crf = train_crf(X_train, y_train)
+    start = time.perf_counter()
+    y_pred = crf.predict(X_test)
+    predict_time = time.perf_counter() - start
+    if save_model:
+        # Saved where create_features.py --epi and parse_server.py load the
+        # profile's CRF from, the F1 below is the one of this model
+        dump(crf, crf_model_file(key))
+    return {
+        "profile": key,
+        "model": model,
+        "load_s": load_time,
+        "lines_per_s": len(lines) / feature_time,
+        "predict_lines_per_s": len(X_test) / predict_time if predict_time else 0,
+        "skipped": len(lines) - len(rows),
+        "f1": metrics.flat_f1_score(
+            y_test, y_pred, average="weighted", labels=list(crf.classes_)
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the spaCy throughput and CRF F1 of the feature profiles"
+    )
+    parser.add_argument(
+        "--data",
+        default=path.join(DATA_DIR, "crf_data.pickle"),
+        help="Pickled DataFrame of the labelled lines with an input column",
+    )
+    parser.add_argument(
+        "--labels",
+        default=path.join(DATA_DIR, "crf_training_labels.pickle"),
+        help="Pickled Series of the token labels of each line",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=sorted(FEATURE_PROFILES),
+        help="Profile to benchmark, can be repeated, all by default",
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        default=[],
+        metavar="PROFILE=MODEL",
+        help="spaCy model to use for a profile instead of its default",
+    )
+    parser.add_argument("--limit", type=int, help="Only use the first lines")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--save-model",
+        action="store_true",
+        help="Save the CRF trained for each profile to models/, replacing the "
+        "one there. The fast profile has no other way to get its model.",
+    )
+    args = parser.parse_args()
+
+    models = {key: profile["model"] for key, profile in FEATURE_PROFILES.items()}
+    models.update(dict(m.split("=", 1) for m in args.model))
+    lines, labels = load_data(args.data, args.labels, args.limit)
+    print("Benchmarking {} labelled lines".format(len(lines)))
+    print(
+        "{:>8} {:>16} {:>8} {:>10} {:>12} {:>8} {:>7}".format(
+            "profile", "model", "load s", "lines/s", "predict/s", "skipped", "F1"
+        )
+    )
+    for key in args.profile or sorted(FEATURE_PROFILES):
+        result = bench_profile(
+            key,
+            models[key],
+            lines,
+            labels,
+            args.test_size,
+            args.seed,
+            args.save_model,
+        )
+        print(
+            "{profile:>8} {model:>16} {load_s:8.2f} {lines_per_s:10.0f} "
+            "{predict_lines_per_s:12.0f} {skipped:8d} {f1:7.3f}".format(**result)
+        )
@@ -0,0 +1,129 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+
+ROOT = path.abspath(path.join(path.dirname(path.abspath(__file__)), "../.."))
+
+# Scripts that are run from the command line, with the arguments of a run
+# that does no work, and the --mba stage run on a small fixture, which
+# should not load spaCy or the models. {fixture} is the fixture directory.
+ENTRY_POINTS = {
+    "get_recipes": ["src/data/get_recipes.py", "--help"],
+    "clean_ingredients": ["src/data/clean_ingredients.py", "--help"],
+    "create_features": ["src/features/create_features.py", "--help"],
+    "create_features --mba": [
+        "src/features/create_features.py",
+        "--mba",
+        "--processed",
+        "{fixture}",
+    ],
+    "parse_server": ["src/features/parse_server.py", "--help"],
+}
+
+# Modules that are slow to import, or that pull in a model
+HEAVY_MODULES = ["spacy", "sklearn", "sklearn_crfsuite", "joblib", "pandas", "numpy"]
+
+# Runs a script as __main__ and prints the heavy modules it imported
+RUNNER = """
+import runpy, sys, json
+sys.argv = {argv!r}
+sys.path.insert(0, {directory!r})
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+
+def make_fixture(directory, recipes=200, ingredients=50):
+    """
+    Writes a small epi_vector.h5 in the layout the --epi stage saves: one
+    quantity column per ingredient followed by 8 recipe columns
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.RandomState(0)
+    values = rng.rand(recipes, ingredients)
+    values[values < 0.8] = 0
+    epi_vec = pd.DataFrame(
+        values, columns=["ingredient {}".format(i) for i in range(ingredients)]
+    )
+    for col in [
+        "avg_rating",
+        "best_rating",
+        "worst_rating",
+        "prepare_again_rating",
+        "num_reviews",
+        "total_time",
+    ]:
+        epi_vec[col] = rng.rand(recipes)
+    epi_vec["tags"] = "tag"
+    epi_vec["title"] = "recipe"
+    epi_vec.to_hdf(
+        path.join(directory, "epi_vector.h5"), key="df", mode="w", format="fixed"
+    )
+
+
+def run_entry_point(argv, python=sys.executable):
+    """
+    Runs `argv` in a fresh interpreter and returns the wall time and the
+    heavy modules it imported
+    """
+    argv = [path.join(ROOT, argv[0])] + argv[1:]
+    code = RUNNER.format(
+        argv=argv, directory=path.dirname(argv[0]), heavy=HEAVY_MODULES
+    )
+    start = time.perf_counter()
+    result = subprocess.run(
+        [python, "-c", code],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def bench_entry_point(argv, repeat):
+    # The best of a few runs, the first one also pays for a cold disk cache
+    times = []
+    for _ in range(repeat):
+        elapsed, modules = run_entry_point(argv)
+        times.append(elapsed)
+    return min(times), modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Times the startup of each entry point in a fresh interpreter"
+    )
+    parser.add_argument(
+        "--entry-point",
+        action="append",
+        choices=sorted(ENTRY_POINTS),
+        help="Entry point to benchmark, can be repeated, all by default",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each")
+    args = parser.parse_args()
+
+    fixture = tempfile.TemporaryDirectory()
+    make_fixture(fixture.name)
+    print("{:>22} {:>9}  {}".format("entry point", "seconds", "heavy modules"))
+    for name in args.entry_point or sorted(ENTRY_POINTS):
+        argv = [arg.format(fixture=fixture.name) for arg in ENTRY_POINTS[name]]
+        try:
+            best, modules = bench_entry_point(argv, args.repeat)
+        except RuntimeError as e:
+            print("{:>22} {:>9}  {}".format(name, "failed", e))
+            continue
+        print("{:>22} {:9.3f}  {}".format(name, best, ", ".join(modules) or "-"))
+    fixture.cleanup()
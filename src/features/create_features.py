@@ -2,13 +2,109 @@
 import sys
 import os
 import uuid
+import json
+import importlib.util
+import hashlib
+import unicodedata
 import argparse
-import spacy
+from multiprocessing import Pool, cpu_count
+# pandas and numpy stay module imports, every stage reads and writes its
+# tables with them
 import pandas as pd
-from joblib import load
 import re
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+from src.features.normalization_cache import NormalizationCache
+from src.features.unit_conversion import convert_units
+
+# spaCy model, the pipeline components to skip and whether the features use
+# the dependency parse. "fast" skips the parser, the slowest component, and
+# needs a CRF trained on its own features.
+FEATURE_PROFILES = {
+    "full": {"model": "en_core_web_lg", "disable": ["ner", "textcat"], "dep": True},
+    "fast": {
+        "model": "en_core_web_sm",
+        "disable": ["parser", "ner", "textcat"],
+        "dep": False,
+    },
+}
+# spaCy and joblib are only imported once lines have to be parsed, so --mba,
+# --help and runs the feature store answers start without them
+profile_key = "full"
+profile = FEATURE_PROFILES[profile_key]
+model_tag = None
+batch_size = 50
+
+
+def profile_name(name, profile_key):
+    """
+    Names the files of each profile, the full profile keeps the
+    original names: crf_model.joblib, crf_model_fast.joblib
+    """
+    if profile_key == "full":
+        return name
+    base, ext = os.path.splitext(name)
+    return "{}_{}{}".format(base, profile_key, ext)
+
+
+def crf_model_file(profile_key):
+    # Our trained CRF model of the profile
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "../../models",
+        profile_name("crf_model.joblib", profile_key),
+    )
+
+
+def missing_crf_model(crf_file, profile_key):
+    """
+    The error message for a CRF model file that does not exist
+    """
+    return (
+        "No CRF model at {}, train and save one with "
+        "src/features/bench_features.py --profile {} --save-model".format(
+            crf_file, profile_key
+        )
+    )
+
+def normalize_text(line):
+    return unicodedata.normalize("NFC", line)
+
+
+def text_key(line):
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()
+
+
+def model_version(model):
+    """
+    Name and version of a spaCy model package or model directory, read from
+    its meta.json without importing spaCy or loading the model
+    """
+    model_path = model
+    if not os.path.isdir(model):
+        spec = importlib.util.find_spec(model)
+        if spec is None:
+            raise OSError("spaCy model {} is not installed".format(model))
+        model_path = os.path.dirname(spec.origin)
+    with open(os.path.join(model_path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    return "{}_{}-{}".format(meta["lang"], meta["name"], meta["version"])
+
+
+def file_digest(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def store_stage(name, *extra):
+    """
+    Feature store stage of the current profile and spaCy model, so features
+    of another profile or model version are never reused
+    """
+    return ":".join([name, profile_key, model_tag or ""] + list(extra))
+
+
 def qty2float(qty):
     try:
         qty = float(qty)
@@ -82,27 +178,27 @@ def format_ingredient_output(tokens, tags, display=False):
 
     return output[0]
 
-def word2features(sent, i):
+def word2features(sent, i, dep=True):
 
     features = {
         "bias": 1.0,
         "lemma": sent[i].lemma_,
         "pos": sent[i].pos_,
         "tag": sent[i].tag_,
-        "dep": sent[i].dep_,
         "shape": sent[i].shape_,
         "is_alpha": sent[i].is_alpha,
         "is_stop": sent[i].is_stop,
         "is_title": sent[i].is_title,
         "is_punct": sent[i].is_punct,
     }
+    if dep:
+        features["dep"] = sent[i].dep_
     if i > 0:
         features.update(
             {
                 "-1:lemma": sent[i - 1].lemma_,
                 "-1:pos": sent[i - 1].pos_,
                 "-1:tag": sent[i - 1].tag_,
-                "-1:dep": sent[i - 1].dep_,
                 "-1:shape": sent[i - 1].shape_,
                 "-1:is_alpha": sent[i - 1].is_alpha,
                 "-1:is_stop": sent[i - 1].is_stop,
@@ -110,13 +206,14 @@ def word2features(sent, i):
                 "-1:is_left_punct": sent[i - 1].is_left_punct,
             }
         )
+        if dep:
+            features["-1:dep"] = sent[i - 1].dep_
         if i > 1:
             features.update(
                 {
                     "-2:lemma": sent[i - 2].lemma_,
                     "-2:pos": sent[i - 2].pos_,
                     "-2:tag": sent[i - 2].tag_,
-                    "-2:dep": sent[i - 2].dep_,
                     "-2:shape": sent[i - 2].shape_,
                     "-2:is_alpha": sent[i - 2].is_alpha,
                     "-2:is_stop": sent[i - 2].is_stop,
@@ -124,6 +221,8 @@ def word2features(sent, i):
                     "-2:is_left_punct": sent[i - 2].is_left_punct,
                 }
             )
+            if dep:
+                features["-2:dep"] = sent[i - 2].dep_
     else:
         features["BOS"] = True
 
@@ -133,7 +232,6 @@ def word2features(sent, i):
                 "+1:lemma": sent[i + 1].lemma_,
                 "+1:pos": sent[i + 1].pos_,
                 "+1:tag": sent[i + 1].tag_,
-                "+1:dep": sent[i + 1].dep_,
                 "+1:shape": sent[i + 1].shape_,
                 "+1:is_alpha": sent[i + 1].is_alpha,
                 "+1:is_stop": sent[i + 1].is_stop,
@@ -141,13 +239,14 @@ def word2features(sent, i):
                 "+1:is_right_punct": sent[i + 1].is_right_punct,
             }
         )
+        if dep:
+            features["+1:dep"] = sent[i + 1].dep_
         if i < len(sent) - 2:
             features.update(
                 {
                     "+2:lemma": sent[i + 2].lemma_,
                     "+2:pos": sent[i + 2].pos_,
                     "+2:tag": sent[i + 2].tag_,
-                    "+2:dep": sent[i + 2].dep_,
                     "+2:shape": sent[i + 2].shape_,
                     "+2:is_alpha": sent[i + 2].is_alpha,
                     "+2:is_stop": sent[i + 2].is_stop,
@@ -155,23 +254,164 @@ def word2features(sent, i):
                     "+2:is_right_punct": sent[i + 2].is_right_punct,
                 }
             )
+            if dep:
+                features["+2:dep"] = sent[i + 2].dep_
     else:
         features["EOS"] = True
 
     return features
 
-def process_data(input_data):
-    # have spacy parse the input string with the full pipeline to generate features this will take some time
-    input_data["input"] = list(
-        nlp.pipe(input_data["input"].astype("unicode").values, batch_size=50)
-    )
+def doc_features(doc, dep=True):
+    # Same features as word2features, read through one Doc.to_array call
+    from src.features.token_arrays import array_features, doc_array
+
+    array, words = doc_array(doc)
+    return array_features(array, words, dep)
+
 
+def init_worker(key, model, crf_file=None, size=50):
+    """
+    Loads the spaCy model of profile `key`, and the CRF model if a file is
+    given, into this process. Runs once in every pool worker, or in the
+    main process when there is no pool.
+    """
+    import spacy
+    from joblib import load
+
+    global nlp, crf, profile, profile_key, batch_size
+    profile_key = key
+    profile = FEATURE_PROFILES[key]
+    batch_size = size
+    nlp = spacy.load(model, disable=profile["disable"])
+    if crf_file:
+        crf = load(crf_file)
+
+
+class Parsers:
+    """
+    Loads the models, in `workers` pool processes or in this one, the first
+    time lines have to be parsed. A run whose lines are all in the feature
+    store never loads spaCy or the CRF.
+    """
+
+    def __init__(self, key, model, crf_file=None, size=50, workers=1, shard_size=1000):
+        self.initargs = (key, model, crf_file, size)
+        self.workers = workers
+        self.shard_size = shard_size
+        self.pool = None
+        self.loaded = False
+
+    def run(self, func, lines):
+        """
+        pipe_parallel of `func` over `lines`, the models loaded first
+        """
+        if not self.loaded:
+            if self.workers > 1:
+                self.pool = Pool(
+                    self.workers, initializer=init_worker, initargs=self.initargs
+                )
+            else:
+                init_worker(*self.initargs)
+            self.loaded = True
+        return pipe_parallel(self.pool, func, lines, self.shard_size)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+def run_shard(job):
+    func, lines = job
+    return func(lines)
+
+
+def shards(lines, shard_size):
+    for start in range(0, len(lines), shard_size):
+        yield lines[start : start + shard_size]
 
-    # Create our features dict
-    features = input_data["input"].apply(
-        lambda doc: [word2features(doc, i) for i in range(len(doc))]
+
+def pipe_parallel(pool, func, lines, shard_size=1000):
+    """
+    Runs `func` over `lines` in shards of `shard_size` lines on the workers
+    of `pool` and returns the results in order. The workers send back
+    feature dicts or parsed ingredients rather than spaCy Docs, which are
+    slow to pickle. Without a pool `func` runs here.
+    """
+    if pool is None:
+        return func(lines)
+    results = []
+    # imap keeps the shards in order while the pool works ahead
+    jobs = ((func, shard) for shard in shards(lines, shard_size))
+    for shard in pool.imap(run_shard, jobs):
+        results.extend(shard)
+    return results
+
+
+def sentence_features(lines):
+    # have spacy parse the input strings with the profile's pipeline to generate features this will take some time
+    # Each line is kept as its token array and words, which is what the
+    # feature store holds, process_data turns them into the CRF input
+    from src.features.token_arrays import doc_array
+
+    return [doc_array(doc) for doc in nlp.pipe(lines, batch_size=batch_size)]
+
+
+def process_data(input_data, cache, parsers):
+    from src.features.token_arrays import arrays_to_crf
+
+    # Only the lines the feature store has not seen yet are parsed
+    arrays = cache.map(
+        store_stage("token_arrays"),
+        lambda lines: parsers.run(sentence_features, lines),
+        [normalize_text(line) for line in input_data["input"].astype("unicode")],
+        key=text_key,
     )
-    return features
+    # The saved features stay one list of word2features dicts per line
+    return pd.Series(arrays_to_crf(arrays, profile["dep"]), index=input_data.index)
+
+
+def parse_ingredients(lines):
+    """
+    Parses, tags and formats the ingredient lines with the CRF model. Each
+    Doc is dropped once its lemmas and features are read.
+    """
+    lemmas = []
+    features = []
+    for doc in nlp.pipe(lines, batch_size=batch_size):
+        lemmas.append([token.lemma_ for token in doc])
+        features.append(doc_features(doc, profile["dep"]))
+    predicted = crf.predict(features)
+    return [
+        format_ingredient_output(tokens, tags)
+        for tokens, tags in zip(lemmas, predicted)
+    ]
+
+
+# Columns of a parsed ingredient, one per CRF tag and the rebuilt input
+PARSED_COLUMNS = ["input", "name", "qty", "unit", "comment"]
+
+
+def stream_parsed(ingredients, cache, stage, parsers, chunk_size=10000):
+    """
+    Parses and tags the input column of `ingredients` `chunk_size` lines at
+    a time and yields each chunk as a DataFrame with metric quantities, so
+    only one chunk of parsed lines is held at once
+    """
+    for start in range(0, len(ingredients), chunk_size):
+        chunk = ingredients["input"].iloc[start : start + chunk_size]
+        # Only the lines the feature store has not parsed and tagged with
+        # this CRF model yet go through spaCy
+        parsed = cache.map(
+            stage,
+            lambda lines: parsers.run(parse_ingredients, lines),
+            [normalize_text(line) for line in chunk.astype("unicode")],
+            key=text_key,
+        )
+        parsed = pd.DataFrame(parsed, index=chunk.index, columns=PARSED_COLUMNS)
+        parsed["qty"] = parsed["qty"].apply(lambda x: qty2float(x))
+        # Now we convert as many units as possible to metric
+        yield convert_units(parsed)
 
 
 if __name__ == '__main__':
@@ -180,11 +420,93 @@ if __name__ == '__main__':
     parser.add_argument("--epi", action="store_true", help="Epicurious Data")
     parser.add_argument("--mba", action="store_true", help="Market Basket Analysis")
     parser.add_argument("-v", action="store_true", help="Verbose")
+    parser.add_argument(
+        "--cache",
+        default=os.path.join(
+            os.path.dirname(__file__), "../../data/interim/feature_store.sqlite"
+        ),
+        help="SQLite feature store that keeps parsed ingredient lines between "
+        "runs, keyed by the line, the profile, the spaCy model and the CRF model",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Parse every line again"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=100000, help="Lines kept in memory"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(FEATURE_PROFILES),
+        default="full",
+        help="Feature profile, fast drops the dependency parser and its features",
+    )
+    parser.add_argument("--spacy-model", help="Overrides the profile's spaCy model")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes that parse ingredient lines, 1 parses in this process. "
+        "Each one loads its own spaCy model, several GB for en_core_web_lg, so "
+        "more are opt-in ({} cores here)".format(cpu_count()),
+    )
+    parser.add_argument(
+        "--shard-size", type=int, default=1000, help="Lines sent to a worker at once"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=50, help="Lines per nlp.pipe batch"
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Epicurious lines parsed and written out at a time",
+    )
+    parser.add_argument(
+        "--parsed",
+        default=os.path.join(
+            os.path.dirname(__file__), "../../data/interim/epi_parsed.csv"
+        ),
+        help="CSV file the parsed Epicurious ingredients are written to",
+    )
+    parser.add_argument(
+        "--processed",
+        default=os.path.join(os.path.dirname(__file__), "../../data/processed"),
+        help="Directory of epi_vector.h5 and basketized.h5",
+    )
     args = parser.parse_args()
 
-    # Load spacy NLP model
-    nlp = spacy.load("en_core_web_lg", disable=["ner", "textcat"])
-    
+    model = args.spacy_model or FEATURE_PROFILES[args.profile]["model"]
+    crf_file = None
+    if args.epi:
+        # Our trained CRF model
+        crf_file = crf_model_file(args.profile)
+        if not os.path.isfile(crf_file):
+            parser.error(missing_crf_model(crf_file, args.profile))
+
+    # spaCy and the CRF are loaded, in every worker when parsing in
+    # parallel, once the feature store misses a line. --mba only reads the
+    # vector back and needs no model, nor the feature store.
+    cache = None
+    parsers = None
+    if args.crf or args.epi:
+        try:
+            model_tag = model_version(model)
+        except OSError as e:
+            parser.error(str(e))
+        cache = NormalizationCache(
+            args.cache_size, None if args.no_cache else args.cache
+        )
+        profile_key = args.profile
+        profile = FEATURE_PROFILES[profile_key]
+        parsers = Parsers(
+            args.profile,
+            model,
+            crf_file,
+            args.batch_size,
+            args.workers,
+            args.shard_size,
+        )
+
     if args.crf:
         # Load cleaned data
         training_data = pd.read_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim/crf_training_data.h5"), 'df')
@@ -194,8 +516,8 @@ if __name__ == '__main__':
             print(training_data.head())
             print(test_data.head())
 
-        training_features = process_data(training_data)
-        test_features = process_data(test_data)
+        training_features = process_data(training_data, cache, parsers)
+        test_features = process_data(test_data, cache, parsers)
 
         if args.v:
             print(type(training_features))
@@ -203,8 +525,8 @@ if __name__ == '__main__':
             print(test_features.head())
 
         # Save features to file
-        training_features.to_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim/crf_training_features.h5"), key="df", mode='w', format="fixed")
-        test_features.to_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim/crf_test_features.h5"), key="df", mode='w', format="fixed")
+        training_features.to_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim", profile_name("crf_training_features.h5", profile_key)), key="df", mode='w', format="fixed")
+        test_features.to_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim", profile_name("crf_test_features.h5", profile_key)), key="df", mode='w', format="fixed")
 
     if args.epi:
         print("CREATING FEATURES FOR EPI DATA")
@@ -213,99 +535,30 @@ if __name__ == '__main__':
         if args.v:
             print(epi_ingredients.head())
 
-        epi_ingredients["input"] = list(
-            nlp.pipe(epi_ingredients["input"].astype("unicode").values, batch_size=50)
+        # Parsed ingredients are written out chunk by chunk and only the
+        # columns the vector needs are read back
+        chunks = stream_parsed(
+            epi_ingredients,
+            cache,
+            store_stage("parsed", file_digest(crf_file)),
+            parsers,
+            args.chunk_size,
         )
-
-        
-
-        features = epi_ingredients["input"].apply(
-        lambda doc: [word2features(doc, i) for i in range(len(doc))]
+        done = 0
+        for parsed in chunks:
+            parsed.to_csv(args.parsed, mode="a" if done else "w", header=not done)
+            done += len(parsed)
+            if args.v:
+                print("parsed {}/{} lines".format(done, len(epi_ingredients)))
+        # The rows come back in order, the index keeps its original type
+        index = epi_ingredients.index
+        del epi_ingredients
+        epi_ingredients = pd.read_csv(
+            args.parsed,
+            usecols=["name", "qty", "unit"],
+            dtype={"name": str, "qty": float, "unit": str},
         )
-
-        epi_ingredients["features"] = pd.DataFrame.from_dict(features)
-
-
-        #lemmas = epi_ingredients["input"].apply(pd.Series, 1).stack()
-        #lemmas.index = lemmas.index.droplevel(-1)
-        #lemmas.name = "lemmas"
-        #epi_ingredients = epi_ingredients.join(lemmas)
-        #print(epi_ingredients.head())
-
-        # Create Features
-        #epi_features = pd.DataFrame(process_data(epi_ingredients))
-        #if args.v:
-        #    print(epi_features.head())
-
-        #epi_ingredients.to_hdf(os.path.join(os.path.dirname(__file__), "../../data/interim/epi_features.h5"), key="df", mode='w', format="table")
-
-
-         # Load our trained CRF model
-        crf = load(os.path.join(os.path.dirname(__file__), "../../models/crf_model.joblib"))
-
-        epi_ingredients["predicted"] = crf.predict(epi_ingredients["features"].values)
-        epi_ingredients["input"] = epi_ingredients["input"].apply(
-            lambda doc: [token.lemma_ for token in doc]
-        )
-
-        parsed = epi_ingredients.apply(
-            lambda x: format_ingredient_output(x.input, x.predicted), axis=1
-        )
-
-        epi_ingredients = pd.DataFrame(parsed.tolist(), index=parsed.index)
-        if args.v:
-            print(epi_ingredients.head())
-        epi_ingredients["qty"] = epi_ingredients["qty"].apply(lambda x: qty2float(x))
-
-        # Now we convert as many units as possible to metric
-        epi_ingredients.loc[epi_ingredients.unit == "pound", "qty"] *= 453.592
-        epi_ingredients.loc[epi_ingredients.unit == "pound", "unit"] = "grams"
-
-        epi_ingredients.loc[epi_ingredients.unit == "teaspoon", "qty"] *= 4.92892
-        epi_ingredients.loc[epi_ingredients.unit == "teaspoon", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "tablespoon", "qty"] *= 14.7868
-        epi_ingredients.loc[
-            epi_ingredients.unit == "tablespoon", "unit"
-        ] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "cup", "qty"] *= 236.588
-        epi_ingredients.loc[epi_ingredients.unit == "cup", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "pinch", "qty"] *= 4.92892 * (
-            1 / 16
-        )
-        epi_ingredients.loc[epi_ingredients.unit == "pinch", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "dash", "qty"] *= 4.92892 * (1 / 8)
-        epi_ingredients.loc[epi_ingredients.unit == "dash", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "ounce", "qty"] *= 28.3495
-        epi_ingredients.loc[epi_ingredients.unit == "ounce", "unit"] = "grams"
-
-        epi_ingredients.loc[epi_ingredients.unit == "fluid ounce", "qty"] *= 29.5735
-        epi_ingredients.loc[
-            epi_ingredients.unit == "fluid ounce", "unit"
-        ] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "pint", "qty"] *= 473.176
-        epi_ingredients.loc[epi_ingredients.unit == "pint", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "quart", "qty"] *= 946.353
-        epi_ingredients.loc[epi_ingredients.unit == "quart", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "liter", "qty"] *= 1000
-        epi_ingredients.loc[epi_ingredients.unit == "liter", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "gallon", "qty"] *= 3785.41
-        epi_ingredients.loc[epi_ingredients.unit == "gallon", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "drop", "qty"] *= 0.05
-        epi_ingredients.loc[epi_ingredients.unit == "drop", "unit"] = "milliliters"
-
-        epi_ingredients.loc[epi_ingredients.unit == "jigger", "qty"] *= 44.3603
-        epi_ingredients.loc[epi_ingredients.unit == "jigger", "unit"] = "milliliters"
-
+        epi_ingredients.index = index
 
         if args.v:
             print(epi_ingredients.head())
@@ -340,17 +593,16 @@ if __name__ == '__main__':
 
         # Let's save our dataframe so we can look at it without having to reload and recompute everything later.
         epi_vec.to_hdf(
-            os.path.join(
-                os.path.dirname(__file__), "../../data/processed/epi_vector.h5"),
+            os.path.join(args.processed, "epi_vector.h5"),
             key="df",
             mode="w",
             format="fixed")
     
 
     if args.mba:
-        if os.path.isfile(os.path.join(os.path.dirname(__file__), "../../data/processed/epi_vector.h5")):
+        if os.path.isfile(os.path.join(args.processed, "epi_vector.h5")):
 
-            epi_df = pd.read_hdf(os.path.join(os.path.dirname(__file__), "../../data/processed/epi_vector.h5"))
+            epi_df = pd.read_hdf(os.path.join(args.processed, "epi_vector.h5"))
             dat = epi_df.values[:, :-8]
             columns = list(epi_df)
             new_vec = []
@@ -364,10 +616,16 @@ if __name__ == '__main__':
             del basketized["index"]
             print(basketized.head())
 
-            basketized.to_hdf(os.path.join(
-                os.path.dirname(__file__), "../../data/processed/basketized.h5"),
+            basketized.to_hdf(
+                os.path.join(args.processed, "basketized.h5"),
                 key="df",
                 mode="w",
                 format="fixed")
         else:
             print("First, generate epi_vector file.")
+
+    if parsers is not None:
+        parsers.close()
+    if cache is not None:
+        cache.report()
+        cache.close()
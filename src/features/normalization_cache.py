@@ -0,0 +1,124 @@
+import pickle
+import sqlite3
+from collections import Counter, OrderedDict
+
+_missing = object()
+
+
+class NormalizationCache:
+    """
+    Cache of per-ingredient results keyed on the raw ingredient string.
+    Results are grouped by stage ("clean", "features", "parsed", ...) so one
+    cache can sit in front of every step of the pipeline. A bounded LRU
+    keeps the hot lines in memory, and with a filename the results also go
+    to an SQLite file so later runs start warm.
+    """
+
+    def __init__(self, maxsize=100000, filename=None):
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.conn = None
+        if filename:
+            self.conn = sqlite3.connect(filename)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "stage TEXT, key TEXT, value BLOB, PRIMARY KEY (stage, key))"
+            )
+
+    def _remember(self, stage, key, value):
+        self.memory[(stage, key)] = value
+        self.memory.move_to_end((stage, key))
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def _lookup(self, stage, key):
+        value = self.memory.get((stage, key), _missing)
+        if value is not _missing:
+            self.memory.move_to_end((stage, key))
+            return value
+        if self.conn is not None:
+            row = self.conn.execute(
+                "SELECT value FROM cache WHERE stage = ? AND key = ?", (stage, key)
+            ).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self._remember(stage, key, value)
+        return value
+
+    def get(self, stage, key, default=None):
+        value = self._lookup(stage, key)
+        if value is _missing:
+            self.misses[stage] += 1
+            return default
+        self.hits[stage] += 1
+        return value
+
+    def put(self, stage, key, value):
+        self._remember(stage, key, value)
+        if self.conn is not None:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                (stage, key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+            )
+
+    def map(self, stage, func, items, key=None):
+        """
+        Returns the results for `items` in order. `func` is called once with
+        the list of distinct items the cache does not have yet, so batch
+        steps like nlp.pipe or crf.predict keep their batching, and must
+        return one result per item. Items are looked up by `key(item)`, or
+        by the item itself. Repeats within `items` count as hits.
+        """
+        results = {}
+        todo = []
+        keys = [key(item) for item in items] if key else items
+        for k, item in zip(keys, items):
+            if k in results:
+                self.hits[stage] += 1
+                continue
+            value = self._lookup(stage, k)
+            if value is _missing:
+                self.misses[stage] += 1
+                todo.append((k, item))
+                # Placeholder so repeats of this key count as hits
+                results[k] = _missing
+            else:
+                self.hits[stage] += 1
+                results[k] = value
+        if todo:
+            for (k, _), value in zip(todo, func([item for _, item in todo])):
+                results[k] = value
+                self.put(stage, k, value)
+            self.flush()
+        return [results[k] for k in keys]
+
+    def stats(self):
+        stats = {}
+        for stage in set(self.hits) | set(self.misses):
+            lookups = self.hits[stage] + self.misses[stage]
+            stats[stage] = {
+                "hits": self.hits[stage],
+                "misses": self.misses[stage],
+                "hit_rate": self.hits[stage] / lookups if lookups else 0,
+            }
+        return stats
+
+    def report(self):
+        for stage, s in sorted(self.stats().items()):
+            print(
+                "{}: {} hits, {} misses, {:.1%} hit rate".format(
+                    stage, s["hits"], s["misses"], s["hit_rate"]
+                )
+            )
+
+    def flush(self):
+        if self.conn is not None:
+            self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
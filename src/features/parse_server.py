@@ -0,0 +1,266 @@
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+from src.features import create_features
+from src.features.normalization_cache import NormalizationCache
+
+
+class MicroBatcher:
+    """
+    Collects the lines of concurrent requests into one call of `parse`, so
+    many small requests share one nlp.pipe and crf.predict batch. A batch
+    is sent as soon as it has `max_batch` lines or its first request has
+    waited `max_wait` seconds. All parsing happens on the batcher's thread.
+    """
+
+    def __init__(self, parse, max_batch=256, max_wait=0.002):
+        self.parse = parse
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.lines = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, lines):
+        """
+        Parses `lines` in the next batch and returns their results
+        """
+        job = {"lines": lines, "done": threading.Event()}
+        self.requests.put(job)
+        job["done"].wait()
+        if "error" in job:
+            raise job["error"]
+        return job["results"]
+
+    def _collect(self):
+        jobs = [self.requests.get()]
+        size = len(jobs[0]["lines"])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job["lines"])
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            lines = [line for job in jobs for line in job["lines"]]
+            try:
+                results = self.parse(lines)
+            except Exception as e:
+                for job in jobs:
+                    job["error"] = e
+                    job["done"].set()
+                continue
+            self.batches += 1
+            self.lines += len(lines)
+            start = 0
+            for job in jobs:
+                job["results"] = results[start : start + len(job["lines"])]
+                start += len(job["lines"])
+                job["done"].set()
+
+
+class ParseHandler(BaseHTTPRequestHandler):
+    """
+    POST /parse with {"line": "..."} or {"lines": [...]} returns
+    {"parsed": {...}} or {"parsed": [...]}. GET /health reports the batch
+    counts.
+    """
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": "not found"})
+            return
+        batcher = self.server.batcher
+        self._send(
+            200,
+            {"status": "ok", "batches": batcher.batches, "lines": batcher.lines},
+        )
+
+    def do_POST(self):
+        if self.path != "/parse":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length))
+            lines = [body["line"]] if "line" in body else body["lines"]
+            if not all(isinstance(line, str) for line in lines):
+                raise ValueError("lines must be strings")
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        try:
+            parsed = self.server.batcher.submit(lines)
+        except Exception as e:
+            self._send(500, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        self._send(200, {"parsed": parsed[0] if "line" in body else parsed})
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # A Unix socket connect with a timeout fails at once when the
+        # server's backlog is full, a blocking one waits its turn
+        self.sock.connect(self.socket_path)
+        self.sock.settimeout(self.timeout)
+
+
+def parse_lines(lines, address="127.0.0.1:8765", timeout=60):
+    """
+    Client for a running server: parses a line or a list of lines. An
+    address without a port is taken as the path of a Unix socket.
+    """
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+    else:
+        conn = UnixHTTPConnection(address, timeout)
+    body = {"line": lines} if isinstance(lines, str) else {"lines": lines}
+    try:
+        conn.request(
+            "POST", "/parse", json.dumps(body), {"Content-Type": "application/json"}
+        )
+        response = conn.getresponse()
+        data = json.loads(response.read())
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(data.get("error", response.reason))
+    return data["parsed"]
+
+
+def make_server(address, batcher, verbose=False):
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        server = ThreadingHTTPServer((host, int(port)), ParseHandler)
+    else:
+        server = UnixHTTPServer(address, ParseHandler)
+    server.batcher = batcher
+    server.verbose = verbose
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keeps the spaCy and CRF models loaded and parses ingredient "
+        "lines sent over HTTP"
+    )
+    parser.add_argument(
+        "--address",
+        default="127.0.0.1:8765",
+        help="host:port to listen on, or the path of a Unix socket",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(create_features.FEATURE_PROFILES),
+        default="full",
+        help="Feature profile, its CRF model must have been trained",
+    )
+    parser.add_argument("--spacy-model", help="Overrides the profile's spaCy model")
+    parser.add_argument("--crf-model", help="Overrides the profile's CRF model")
+    parser.add_argument(
+        "--max-batch", type=int, default=256, help="Most lines parsed at once"
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=2.0,
+        help="Milliseconds a request waits for others to batch with",
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=100000, help="Parsed lines kept in memory"
+    )
+    parser.add_argument("-v", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    profile = create_features.FEATURE_PROFILES[args.profile]
+    model = args.spacy_model or profile["model"]
+    crf_file = args.crf_model or create_features.crf_model_file(args.profile)
+    if not os.path.isfile(crf_file):
+        parser.error(create_features.missing_crf_model(crf_file, args.profile))
+    start = time.perf_counter()
+    create_features.init_worker(args.profile, model, crf_file)
+    print(
+        "Loaded {} and {} in {:.1f}s".format(
+            model, crf_file, time.perf_counter() - start
+        )
+    )
+
+    # Repeated lines are answered from memory without touching the models
+    cache = NormalizationCache(args.cache_size)
+    batcher = MicroBatcher(
+        lambda lines: cache.map(
+            "parsed",
+            create_features.parse_ingredients,
+            [create_features.normalize_text(line) for line in lines],
+        ),
+        args.max_batch,
+        args.max_wait / 1000,
+    )
+    server = make_server(args.address, batcher, args.v)
+    print("Parsing ingredient lines on {}".format(args.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        cache.report()
@@ -0,0 +1,131 @@
+from operator import itemgetter
+
+import numpy as np
+
+# Token attributes read out of a Doc in one Doc.to_array call, by their
+# spaCy names so that decoding stored lines does not import spaCy. The first
+# STRING_ATTRS columns hold strings, the rest are flags.
+TOKEN_ATTRS = [
+    "LEMMA",
+    "POS",
+    "TAG",
+    "SHAPE",
+    "DEP",
+    "IS_ALPHA",
+    "IS_STOP",
+    "IS_TITLE",
+    "IS_PUNCT",
+    "IS_LEFT_PUNCT",
+    "IS_RIGHT_PUNCT",
+]
+STRING_ATTRS = 5
+COLUMNS = [attr.lower() for attr in TOKEN_ATTRS]
+
+# The attributes word2features uses for a token, for the tokens before it
+# and for the tokens after it. dep is added last when the profile has it.
+WINDOW = ["lemma", "pos", "tag", "shape", "is_alpha", "is_stop", "is_title"]
+CENTER = WINDOW + ["is_punct"]
+LEFT = WINDOW + ["is_left_punct"]
+RIGHT = WINDOW + ["is_right_punct"]
+
+
+def window(attrs, dep):
+    if dep:
+        attrs = attrs + ["dep"]
+    return attrs, itemgetter(*[COLUMNS.index(name) for name in attrs])
+
+
+def layout(dep, before, after):
+    """
+    Feature names of a token with `before` and `after` neighbours (0 to 2)
+    in the order word2features adds them
+    """
+    center = window(CENTER, dep)[0]
+    left = window(LEFT, dep)[0]
+    right = window(RIGHT, dep)[0]
+    keys = ["bias"] + center
+    for k in range(1, before + 1):
+        keys += ["-{}:{}".format(k, name) for name in left]
+    if not before:
+        keys.append("BOS")
+    for k in range(1, after + 1):
+        keys += ["+{}:{}".format(k, name) for name in right]
+    if not after:
+        keys.append("EOS")
+    return keys
+
+
+# Column getters of a token, the tokens before it and the tokens after it
+GETTERS = {
+    dep: [window(attrs, dep)[1] for attrs in [CENTER, LEFT, RIGHT]]
+    for dep in [True, False]
+}
+LAYOUTS = {
+    (dep, before, after): layout(dep, before, after)
+    for dep in [True, False]
+    for before in range(3)
+    for after in range(3)
+}
+
+
+def doc_array(doc):
+    """
+    Reads the token attributes of `doc` into an (n tokens, TOKEN_ATTRS)
+    array. The string columns hold indices into the returned tuple of words
+    rather than spaCy hashes, so a line can be decoded without the model.
+    """
+    array = doc.to_array(TOKEN_ATTRS)
+    hashes = array[:, :STRING_ATTRS].ravel().tolist()
+    codes = {h: i for i, h in enumerate(dict.fromkeys(hashes))}
+    array[:, :STRING_ATTRS] = np.array(
+        list(map(codes.__getitem__, hashes)), dtype=np.uint64
+    ).reshape(len(array), STRING_ATTRS)
+    strings = doc.vocab.strings
+    return array.astype(np.uint32), tuple(strings[h] for h in codes)
+
+
+def array_features(array, words, dep=True):
+    """
+    Turns a line read by doc_array into the CRF input of word2features, one
+    feature dict per token. Each window position is a block of columns
+    taken from the decoded token rows, the neighbours are the same blocks
+    shifted by one or two rows.
+    """
+    decode = words.__getitem__
+    rows = [
+        [*map(decode, row[:STRING_ATTRS]), *map(bool, row[STRING_ATTRS:])]
+        for row in array.tolist()
+    ]
+    center, left, right = GETTERS[dep]
+    centers = list(map(center, rows))
+    # -1 and -2, and +1 and +2, read the same columns of different rows
+    lefts = list(map(left, rows))
+    rights = list(map(right, rows))
+
+    n = len(rows)
+    features = []
+    for i in range(n):
+        values = (1.0,) + centers[i]
+        before = min(i, 2)
+        if before:
+            values += lefts[i - 1]
+            if before == 2:
+                values += lefts[i - 2]
+        else:
+            values += (True,)
+        after = min(n - 1 - i, 2)
+        if after:
+            values += rights[i + 1]
+            if after == 2:
+                values += rights[i + 2]
+        else:
+            values += (True,)
+        features.append(dict(zip(LAYOUTS[dep, before, after], values)))
+    return features
+
+
+def arrays_to_crf(lines, dep=True):
+    """
+    CRF input for a list or Series of (array, words) lines
+    """
+    return [array_features(array, words, dep) for array, words in lines]
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+# Metric factor and unit for every unit the ingredient tagger finds.
+# Weights go to grams and volumes to milliliters.
+UNIT_CONVERSIONS = {
+    "pound": (453.592, "grams"),
+    "ounce": (28.3495, "grams"),
+    "teaspoon": (4.92892, "milliliters"),
+    "tablespoon": (14.7868, "milliliters"),
+    "cup": (236.588, "milliliters"),
+    "pinch": (4.92892 * (1 / 16), "milliliters"),
+    "dash": (4.92892 * (1 / 8), "milliliters"),
+    "fluid ounce": (29.5735, "milliliters"),
+    "pint": (473.176, "milliliters"),
+    "quart": (946.353, "milliliters"),
+    "liter": (1000, "milliliters"),
+    "gallon": (3785.41, "milliliters"),
+    "drop": (0.05, "milliliters"),
+    "jigger": (44.3603, "milliliters"),
+}
+
+
+def factor(unit):
+    return UNIT_CONVERSIONS[unit][0]
+
+
+def convert_units(frame, qty="qty", unit="unit", conversions=UNIT_CONVERSIONS):
+    """
+    Converts the `qty` and `unit` columns of `frame` to metric with one pass
+    over the unit column and returns a new DataFrame. Each distinct unit is
+    looked up once and its factor and metric unit are spread back by the
+    unit codes. Units missing from `conversions` and NaN are left as they are.
+    """
+    codes, uniques = pd.factorize(frame[unit])
+    factors = np.ones(len(uniques))
+    metric = np.empty(len(uniques), dtype=object)
+    for i, name in enumerate(uniques):
+        factors[i], metric[i] = conversions.get(name, (1, name))
+    missing = codes == -1
+    # Code -1 marks a missing unit, which keeps its qty and unit
+    codes[missing] = 0
+
+    frame = frame.copy()
+    if len(uniques):
+        frame[qty] = frame[qty].where(missing, frame[qty] * factors.take(codes))
+        frame[unit] = frame[unit].where(missing, metric.take(codes))
+    return frame
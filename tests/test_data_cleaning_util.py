@@ -0,0 +1,126 @@
+import sys
+from os import path
+
+import pandas as pd
+import pytest
+import unidecode
+
+sys.path.append(path.join(path.dirname(path.abspath(__file__)), ".."))
+from src.data import data_cleaning_util, legacy_cleaning
+from src.features.normalization_cache import NormalizationCache
+
+
+LEMMAS = {"tablespoons": "tablespoon", "cups": "cup"}
+
+
+class Token:
+    def __init__(self, text):
+        self.lemma_ = LEMMAS.get(text.lower(), text.lower())
+
+
+class LemmaNLP:
+    """
+    Stands in for a spaCy pipeline: splits on spaces and lemmatizes the
+    plural units
+    """
+
+    pipe_names = ["tagger", "parser", "ner"]
+
+    def __call__(self, line):
+        return [Token(word) for word in line.split(" ")]
+
+    def pipe(self, lines, batch_size=1000, disable=()):
+        return map(self, lines)
+
+
+def test_fix_measurements_series_duplicate_index():
+    nlp = LemmaNLP()
+    lines = [
+        "1 stick plus 2 tablespoons butter",
+        "2 cups flour",
+        "1 cup plus 2 tablespoons sugar",
+        float("nan"),
+    ]
+    series = pd.Series(lines, index=[5, 5, 6, 7], name="input")
+    fixed = data_cleaning_util.fix_measurements_series(series, nlp)
+
+    expected = [data_cleaning_util.fix_measurements(line, nlp) for line in lines[:3]]
+    assert fixed.index.tolist() == [5, 5, 6, 7]
+    assert fixed.iloc[:3].tolist() == expected
+    assert fixed.iloc[0] != lines[0]
+    assert pd.isna(fixed.iloc[3])
+    assert series.tolist()[:3] == lines[:3]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "butter, 4 oz.",
+        "2 oz.",
+        "milk, 250 ml.",
+        "1 ozone, 2 oz.",
+        "8 oz. cream cheese",
+        "2 lbs potatoes",
+        " lb lb  lb ",
+    ],
+)
+def test_fix_abbreviations_matches_old_loops(line):
+    expected = legacy_cleaning.fix_abbreviations(line)
+    assert data_cleaning_util.fix_abbreviations(line) == expected
+
+
+def test_clean_series_cache_keeps_nan():
+    series = pd.Series(["1 cup flour", None, "2 eggs", None], index=[3, 3, 4, 5])
+    cached = data_cleaning_util.clean_series(series, cache=NormalizationCache(10))
+    pd.testing.assert_series_equal(cached, data_cleaning_util.clean_series(series))
+    assert cached.isna().tolist() == [False, True, False, True]
+
+    empty = pd.Series([None, None], dtype=object)
+    cached = data_cleaning_util.clean_series(empty, cache=NormalizationCache(10))
+    assert all(isinstance(value, float) for value in cached)
+
+
+def legacy_quantities(string):
+    string = legacy_cleaning.clean_unicode_fractions(string)
+    string = unidecode.unidecode(string)
+    string = legacy_cleaning.merge_fractions(string)
+    return legacy_cleaning.merge_quantities(string)
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("1½ cups", "1.5 cups"),
+        ("1 ¾ cups", "1.75 cups"),
+        ("1-1/2 cups", "1.5 cups"),
+        ("2 8.5-ounce cans", "17 ounce cans"),
+        ("3 to 4 pounds", "3.5 pounds"),
+        ("1.5 or 2", "1.75"),
+        ("1-2 cloves", "1.5 cloves"),
+    ],
+)
+def test_normalize_quantities_matches_old_chain(line, expected):
+    assert legacy_quantities(line) == expected
+    assert data_cleaning_util.normalize_quantities(line) == expected
+
+
+@pytest.mark.parametrize(
+    "line, old, expected",
+    [
+        ("1/4-1/2 teaspoon", "0.25.5 teaspoon", "0.38 teaspoon"),
+        ("1/2–3/4 cup", "0.5.75 cup", "0.63 cup"),
+        ("3.5-1/2 cups", "3.5.5 cups", "2 cups"),
+        ("1 2 3 4 eggs", "12 4 eggs", "2 12 eggs"),
+    ],
+)
+def test_normalize_quantities_merges_once(line, old, expected):
+    # The old chain re-matched its own output in these shapes
+    assert legacy_quantities(line) == old
+    assert data_cleaning_util.normalize_quantities(line) == expected
+
+
+def test_normalize_quantities_fraction_over_zero():
+    with pytest.raises(ZeroDivisionError):
+        legacy_quantities("1/0 cup")
+    assert data_cleaning_util.normalize_quantities("1/0 cup") == "1/0 cup"
+    assert data_cleaning_util.normalize_quantities("½/0.25 cup") == "0.5/0.25 cup"